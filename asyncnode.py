@@ -0,0 +1,737 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import asyncio
+import base64
+import json
+
+from itertools    import count
+from urllib.parse import urlparse
+
+# Exception classes shared with the synchronous RPC interface
+
+from slickrpc import exc
+
+from cryptonode import cryptoNode, cryptoNodeException, load_backend
+
+DEFAULT_RPC_TIMEOUT     = 30
+DEFAULT_RPC_CONNECTIONS = 4
+
+################################################################################
+## asyncProxy class ############################################################
+################################################################################
+
+class asyncProxy():
+
+	_ids = count(0)
+
+	############################################################################
+
+	def __init__(self, service_url, timeout = DEFAULT_RPC_TIMEOUT, connections = DEFAULT_RPC_CONNECTIONS):
+
+		url = urlparse(service_url)
+
+		self.host    = url.hostname
+		self.port    = url.port
+		self.auth    = base64.b64encode('{}:{}'.format(url.username, url.password).encode()).decode()
+		self.timeout = timeout
+
+		self.idle    = []							# Keep-alive connections available for reuse
+		self.slots   = asyncio.Semaphore(connections)
+
+	############################################################################
+
+	def __getattr__(self, method):
+
+		async def call(*params):
+
+			return await self.call(method, *params)
+
+		return call
+
+	############################################################################
+
+	async def call(self, method, *params, timeout = None):
+
+		async with self.slots:
+
+			return await asyncio.wait_for(self._call(method, params), timeout or self.timeout)
+
+	############################################################################
+
+	async def _call(self, method, params):
+
+		body = json.dumps({'jsonrpc' : '2.0',
+						   'method'  : method,
+						   'params'  : params,
+						   'id'      : next(self._ids)}).encode()
+
+		head = ('POST / HTTP/1.1\r\n'
+				'Host: {}:{}\r\n'
+				'Authorization: Basic {}\r\n'
+				'Content-Type: application/json\r\n'
+				'Content-Length: {:d}\r\n'
+				'\r\n').format(self.host, self.port, self.auth, len(body)).encode()
+
+		# The daemon closes connections left idle too long (rpcservertimeout). Those seen to be closed are
+		# dropped, and otherwise a request is only sent again on a new connection when it cannot have been
+		# acted on - the write failed, or an idle connection was closed without a word of response. Any
+		# other failure could follow a sendtoaddress or sendpacket the daemon has carried out
+
+		while self.idle and self.idle[-1][0].at_eof():
+
+			self.idle.pop()[1].close()
+
+		for reuse in ((True, False) if self.idle else (False,)):
+
+			(reader, writer) = self.idle.pop() if reuse else await asyncio.open_connection(self.host, self.port)
+
+			try:
+
+				writer.write(head + body)
+
+				await writer.drain()
+
+			except OSError:
+
+				writer.close()
+
+				if reuse:
+
+					continue
+
+				raise
+
+			except BaseException:
+
+				writer.close()
+
+				raise
+
+			try:
+
+				status_line = await reader.readline()
+
+			except BaseException:
+
+				writer.close()
+
+				raise
+
+			if status_line or not reuse:
+
+				break
+
+			writer.close()
+
+		if not status_line:
+
+			writer.close()
+
+			raise ConnectionResetError('RPC connection closed by server')
+
+		try:
+
+			(status, headers, content) = await self._read_response(status_line, reader)
+
+		except BaseException:
+
+			# Includes cancellation and timeout - the stream state is unknown so it cannot be reused
+
+			writer.close()
+
+			raise
+
+		if headers.get('connection', '').lower() == 'close':
+
+			writer.close()
+
+		else:
+
+			self.idle.append((reader, writer))
+
+		if status == 401:
+
+			raise ValueError('RPC authorization failed')
+
+		resp = json.loads(content)
+
+		if resp.get('error') is not None:
+
+			raise exc.RpcException(resp['error'], method, params)
+
+		return resp['result']
+
+	############################################################################
+
+	async def _read_response(self, status_line, reader):
+
+		status  = int(status_line.split()[1])
+		headers = {}
+
+		while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+
+			(name, _, value) = line.decode('latin-1').partition(':')
+
+			headers[name.strip().lower()] = value.strip()
+
+		if 'content-length' in headers:
+
+			content = await reader.readexactly(int(headers['content-length']))
+
+		elif headers.get('transfer-encoding', '').lower() == 'chunked':
+
+			content = b''
+
+			while (size := int((await reader.readline()).split(b';')[0], 16)) > 0:
+
+				content += await reader.readexactly(size)
+
+				await reader.readline()
+
+			await reader.readline()
+
+		else:
+
+			content = await reader.read()
+
+			headers['connection'] = 'close'
+
+		return (status, headers, content)
+
+	############################################################################
+
+	async def close(self):
+
+		while self.idle:
+
+			(reader, writer) = self.idle.pop()
+
+			writer.close()
+
+################################################################################
+## asyncCryptoNode class #######################################################
+################################################################################
+
+class asyncCryptoNode(cryptoNode):
+
+	############################################################################
+
+	def __init__(self, symbol, rpc_address, rpc_user, rpc_pass, timeout = DEFAULT_RPC_TIMEOUT):
+
+		super().__init__(symbol, rpc_address, rpc_user, rpc_pass)
+
+		self.timeout = timeout
+
+	############################################################################
+
+	async def initialise(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def refresh(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def get_balance(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def get_unlocked_balance(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def get_unconfirmed_balance(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def get_new_address(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def wallet_locked(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def unlock_wallet(self, passphrase, seconds):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def send_to_address(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	async def shutdown(self):
+
+		raise NotImplementedError
+
+################################################################################
+## asyncBitcoinNode class ######################################################
+################################################################################
+
+class asyncBitcoinNode(asyncCryptoNode):
+
+	############################################################################
+
+	def __init__(self, symbol, rpc_address, rpc_user, rpc_pass, timeout = DEFAULT_RPC_TIMEOUT):
+
+		super().__init__(symbol, rpc_address, rpc_user, rpc_pass, timeout)
+
+		self.proxy = asyncProxy('http://%s:%s@%s' % (rpc_user, rpc_pass, rpc_address), timeout)
+
+	############################################################################
+
+	def __getattr__(self, method):
+
+		return getattr(self.proxy, method)
+
+	############################################################################
+
+	async def initialise(self):
+
+		try:
+
+			info = await self.proxy.getnetworkinfo()
+
+		except ValueError:
+
+			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} daemon'.format(self.symbol))
+
+		except (OSError, asyncio.TimeoutError):
+
+			raise cryptoNodeException('Failed to connect - check that {} daemon is running'.format(self.symbol))
+
+		except exc.RpcInWarmUp:
+
+			raise cryptoNodeException('Failed to connect - {} daemon is starting but not ready - try again after 60 seconds'.format(self.symbol))
+
+		except exc.RpcMethodNotFound:
+
+			raise cryptoNodeException('RPC getnetworkinfo unavailable for {} daemon'.format(self.symbol))
+
+		self.check_version(info)
+
+		await self.find_zmq_address()
+
+	############################################################################
+
+	def check_version(self, info):
+
+		pass
+
+	############################################################################
+
+	async def find_zmq_address(self):
+
+		try:
+
+			zmqnotifications = await self.proxy.getzmqnotifications()
+
+		except (OSError, asyncio.TimeoutError):
+
+			raise cryptoNodeException('Blockchain node for {} not available or incorrectly configured'.format(self.symbol))
+
+		except (exc.RpcMethodNotFound, ValueError):
+
+			zmqnotifications = []
+
+		packetAddress = ''
+
+		for zmqnotification in zmqnotifications:
+
+			if zmqnotification['type'] == 'pubhashblock':
+
+				self.zmqAddress = zmqnotification['address']
+
+			if zmqnotification['type'] == 'pubpacket':
+
+				packetAddress = zmqnotification['address']
+
+		# Packet notifications are only received if published on the hashblock socket
+
+		self.zmqPackets = bool(packetAddress) and packetAddress == self.zmqAddress
+
+	############################################################################
+
+	async def refresh(self):
+
+		(self.blocks, self.peers) = await asyncio.gather(self.proxy.getblockcount(), self.proxy.getconnectioncount())
+
+	############################################################################
+
+	async def get_balance(self):
+
+		try:
+
+			result = await self.proxy.getbalance()
+
+		except exc.RpcException as error:
+
+			raise cryptoNodeException('{} daemon returned error: {}'.format(self.symbol, str(error)))
+
+		else:
+
+			return result
+
+	############################################################################
+
+	async def get_unlocked_balance(self):
+
+		return await self.get_balance()
+
+	############################################################################
+
+	async def get_unconfirmed_balance(self):
+
+		try:
+
+			result = await self.proxy.getunconfirmedbalance()
+
+		except exc.RpcException as error:
+
+			raise cryptoNodeException('{} daemon returned error: {}'.format(self.symbol, str(error)))
+
+		else:
+
+			return result
+
+	############################################################################
+
+	async def get_new_address(self):
+
+		return await self.proxy.getnewaddress()
+
+	############################################################################
+
+	async def wallet_locked(self):
+
+		info = await self.proxy.getwalletinfo()
+
+		if 'unlocked_until' in info:
+
+			return info['unlocked_until'] == 0
+
+		return False
+
+	############################################################################
+
+	async def unlock_wallet(self, passphrase, seconds):
+
+		try:
+
+			await self.proxy.walletpassphrase(passphrase, seconds)
+
+		except exc.RpcWalletPassphraseIncorrect:
+
+			return False
+
+		else:
+
+			return True
+
+	############################################################################
+
+	async def send_to_address(self, address, amount, comment):
+
+		try:
+
+			txid = await self.proxy.sendtoaddress(address, amount, comment)
+
+		except exc.RpcWalletUnlockNeeded:
+
+			raise cryptoNodeException('Wallet locked - please unlock')
+
+		except exc.RpcWalletInsufficientFunds:
+
+			raise cryptoNodeException('Insufficient funds in wallet')
+
+		except exc.RpcTypeError:
+
+			raise cryptoNodeException('Invalid amount')
+
+		except exc.RpcWalletError:
+
+			raise cryptoNodeException('Amount too small')
+
+		else:
+
+			return txid
+
+	############################################################################
+
+	async def shutdown(self):
+
+		await self.proxy.close()
+
+################################################################################
+## asyncEccoinNode class #######################################################
+################################################################################
+
+class asyncEccoinNode(asyncBitcoinNode):
+
+	version_min = 30000
+	version_max = 30201
+
+	bufferIdx = count(start=1)
+
+	poll_min    = 0.2
+	poll_max    = 3.2
+	poll_factor = 2
+
+	############################################################################
+
+	def __init__(self, symbol, rpc_address, rpc_user, rpc_pass, protocol_id, timeout = DEFAULT_RPC_TIMEOUT):
+
+		super().__init__(symbol, rpc_address, rpc_user, rpc_pass, timeout)
+
+		self.protocolId = protocol_id
+		self.routingTag = ''
+		self.bufferKey  = ''
+
+		self.zmqPackets   = False
+		self.pollInterval = self.poll_min
+
+	############################################################################
+
+	def check_version(self, info):
+
+		if not self.version_min <= info['version'] <= self.version_max:
+
+			raise cryptoNodeException('eccoind version {} not supported - please run a version in the range {}-{}'.format(info['version'], self.version_min, self.version_max))
+
+	############################################################################
+
+	async def initialise(self):
+
+		try:
+
+			info = await self.proxy.getnetworkinfo()
+
+		except ValueError:
+
+			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for eccoin')
+
+		except (OSError, asyncio.TimeoutError):
+
+			raise cryptoNodeException('Failed to connect - check that eccoin daemon is running')
+
+		except exc.RpcInWarmUp:
+
+			raise cryptoNodeException('Failed to connect -  eccoin daemon is starting but not ready - try again after 60 seconds')
+
+		except exc.RpcMethodNotFound:
+
+			raise cryptoNodeException('RPC getnetworkinfo unavailable for {} daemon'.format(self.symbol))
+
+		self.check_version(info)
+
+		try:
+
+			self.routingTag = await self.proxy.getroutingpubkey()
+			self.bufferKey  = await self.proxy.registerbuffer(self.protocolId)
+
+		except exc.RpcInternalError:
+
+			raise cryptoNodeException('API Buffer was not correctly unregistered or another instance running - try again after 60 seconds')
+
+		await self.find_zmq_address()
+
+	############################################################################
+
+	async def get_balance(self):
+
+		return await self.proxy.getbalance()
+
+	############################################################################
+
+	async def reset_buffer_timeout(self):
+
+		if self.bufferKey:
+
+			bufferSig = await self.proxy.buffersignmessage(self.bufferKey, 'ResetBufferTimeout')
+
+			await self.proxy.resetbuffertimeout(self.protocolId, bufferSig)
+
+			return True
+
+		return False
+
+	############################################################################
+
+	async def setup_route(self, targetRoute):
+
+		try:
+
+			await self.proxy.findroute(targetRoute)
+
+			isRoute = await self.proxy.haveroute(targetRoute)
+
+		except exc.RpcInvalidAddressOrKey:
+
+			raise cryptoNodeException('Routing tag has invalid base64 encoding : {}'.format(targetRoute))
+
+		if not isRoute:
+
+			raise cryptoNodeException('No route available to : {}'.format(targetRoute))
+
+	############################################################################
+
+	async def get_buffer(self, protocol_id = 1):
+
+		assert protocol_id == self.protocolId
+
+		if self.bufferKey:
+
+			bufferCmd = 'GetBufferRequest:' + str(protocol_id) + str(next(self.bufferIdx))
+
+			bufferSig = await self.proxy.buffersignmessage(self.bufferKey, bufferCmd)
+
+			eccbuffer = await self.proxy.getbuffer(protocol_id, bufferSig)
+
+			return eccbuffer
+
+		else:
+
+			return None
+
+	############################################################################
+
+	async def poll_buffer(self):
+
+		eccbuffer = await self.get_buffer(self.protocolId)
+
+		if eccbuffer:
+
+			self.pollInterval = self.poll_min
+
+		else:
+
+			self.pollInterval = min(self.poll_max, self.pollInterval * self.poll_factor)
+
+		return eccbuffer
+
+	############################################################################
+
+	def poll_reset(self):
+
+		self.pollInterval = self.poll_min
+
+	############################################################################
+
+	async def shutdown(self):
+
+		if self.bufferKey:
+
+			bufferSig = await self.proxy.buffersignmessage(self.bufferKey, 'ReleaseBufferRequest')
+
+			await self.proxy.releasebuffer(self.protocolId, bufferSig)
+
+			self.bufferKey = ''
+
+		await self.proxy.close()
+
+################################################################################
+## asyncMoneroNode class #######################################################
+################################################################################
+
+class asyncMoneroNode(asyncCryptoNode):
+
+	# The monero library only offers a blocking interface, so each call is run
+	# in the default executor to keep the event loop responsive
+
+	############################################################################
+
+	def __init__(self, symbol, rpc_address, rpc_daemon, rpc_user, rpc_pass, timeout = DEFAULT_RPC_TIMEOUT):
+
+		super().__init__(symbol, rpc_address, rpc_user, rpc_pass, timeout)
+
+		self.node = load_backend('monero')(symbol, rpc_address, rpc_daemon, rpc_user, rpc_pass)
+
+	############################################################################
+
+	async def run(self, function, *args):
+
+		return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, function, *args), self.timeout)
+
+	############################################################################
+
+	async def initialise(self):
+
+		await self.run(self.node.initialise)
+
+	############################################################################
+
+	async def refresh(self):
+
+		await self.run(self.node.refresh)
+
+		self.blocks = self.node.blocks
+		self.peers  = self.node.peers
+
+	############################################################################
+
+	async def get_balance(self):
+
+		return await self.run(self.node.get_balance)
+
+	############################################################################
+
+	async def get_unlocked_balance(self):
+
+		return await self.run(self.node.get_unlocked_balance)
+
+	############################################################################
+
+	async def get_unconfirmed_balance(self):
+
+		return await self.run(self.node.get_unconfirmed_balance)
+
+	############################################################################
+
+	async def get_new_address(self):
+
+		return await self.run(self.node.get_new_address)
+
+	############################################################################
+
+	async def wallet_locked(self):
+
+		return False
+
+	############################################################################
+
+	async def unlock_wallet(self, passphrase, seconds):
+
+		return True
+
+	############################################################################
+
+	async def send_to_address(self, address, amount, comment):
+
+		return await self.run(self.node.send_to_address, address, amount, comment)
+
+	############################################################################
+
+	async def shutdown(self):
+
+		pass
+
+################################################################################
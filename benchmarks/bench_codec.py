@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import argparse
+import platform
+import pathlib
+import random
+import string
+import timeit
+import json
+import csv
+import sys
+
+from uuid import uuid4
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from eccpacket import eccPacket
+
+################################################################################
+
+TAG = 'BImGKLu0cwgmRigdvoWTnJdQ0Q+QgscUzJgsdChUOTi2dkM6wF/KXf84w9VjIydfIwl3EDgNPvjLP3HgNyifZ9w='
+
+FIELDS = ('meth', 'size', 'op', 'ops_per_sec', 'bytes_per_op')
+
+################################################################################
+
+def sample_text(size):
+
+	return ''.join(random.choices(string.ascii_letters + string.digits + ' ', k = size))
+
+################################################################################
+
+def sample_value(key, size):
+
+	# Fixed width fields keep their usual values - the free text fields carry the payload
+
+	if key == 'uuid':
+
+		return str(uuid4())
+
+	if key == 'uids':
+
+		return [str(uuid4()) for _ in range(max(1, size // 36))]
+
+	if key == 'msgs':
+
+		return [{'meth' : eccPacket.METH_chatMsg, 'data' : sample_data(eccPacket.METH_chatMsg, max(1, size // 4))} for _ in range(4)]
+
+	if key == 'caps':
+
+		return sorted(eccPacket.CAPS)
+
+	if key in ('able', 'resp'):
+
+		return True
+
+	if key in ('indx', 'seqn'):
+
+		return 0
+
+	if key == 'size':
+
+		return 1
+
+	if key == 'cmmd':
+
+		return 'add'
+
+	if key in ('coin', 'cogv', 'cotk'):
+
+		return 'ecc'
+
+	if key in ('amnt', 'amgv', 'amtk'):
+
+		return '10.000000'
+
+	return sample_text(size)
+
+################################################################################
+
+def sample_data(meth, size):
+
+	return {key : sample_value(key, size) for key in eccPacket.KEY_LIST[meth]}
+
+################################################################################
+
+def operations(meth, size):
+
+	# (name, callable, bytes handled per call) for each stage a packet goes through
+
+	data   = sample_data(meth, size)
+	packet = eccPacket(1, 1, TAG, TAG, meth, data)
+
+	text = packet.to_json()
+
+	# getbuffer returns each packet hex encoded, as decoded by zmqHandler
+
+	hex_json    = text.encode().hex()
+	hex_compact = packet.to_compact().encode().hex()
+
+	return [('construct'       , lambda: eccPacket(1, 1, TAG, TAG, meth, data), len(json.dumps(data))),
+			('to_json'         , packet.to_json                               , len(text)),
+			('from_json'       , lambda: eccPacket.from_json(text)            , len(text)),
+			('validate'        , lambda: eccPacket.validate(meth, data)       , len(json.dumps(data))),
+			('get_data'        , packet.get_data                              , len(json.dumps(data))),
+			('from_hex'        , lambda: eccPacket.from_hex(hex_json)         , len(hex_json)),
+			('from_hex_compact', lambda: eccPacket.from_hex(hex_compact)      , len(hex_compact))]
+
+################################################################################
+
+def rate(function, repeat):
+
+	# Best of several runs, each long enough to time reliably
+
+	timer = timeit.Timer(function)
+
+	(number, _) = timer.autorange()
+
+	return number / min(timer.repeat(repeat = repeat, number = number))
+
+################################################################################
+
+def run(sizes, repeat):
+
+	for meth in eccPacket.METH_SET:
+
+		for size in sizes:
+
+			for (op, function, nbytes) in operations(meth, size):
+
+				yield {'meth' : str(meth), 'size' : size, 'op' : op, 'ops_per_sec' : round(rate(function, repeat), 1), 'bytes_per_op' : nbytes}
+
+################################################################################
+
+def main():
+
+	argparser = argparse.ArgumentParser(description='eccPacket encode and decode throughput for every method')
+
+	argparser.add_argument('-s', '--sizes' , action='store', help='payload sizes (bytes)', type=int, default=[16, 256, 2048], nargs='+'                 , required=False)
+	argparser.add_argument('-r', '--repeat', action='store', help='runs per test'        , type=int, default=5                                           , required=False)
+	argparser.add_argument('-f', '--format', action='store', help='output format'        , type=str, default='json'         , choices=['json', 'csv'], required=False)
+	argparser.add_argument('-o', '--output', action='store', help='output file'          , type=str, default='-'                                         , required=False)
+
+	args = argparser.parse_args()
+
+	random.seed(1)
+
+	output = sys.stdout if args.output == '-' else open(args.output, 'w', newline = '')
+
+	if args.format == 'json':
+
+		# One document, with enough about the run to tell comparable results apart
+
+		results = {'python'  : platform.python_version(),
+				   'machine' : platform.machine(),
+				   'sizes'   : args.sizes,
+				   'repeat'  : args.repeat,
+				   'results' : list(run(args.sizes, args.repeat))}
+
+		json.dump(results, output, indent = 1)
+
+		output.write('\n')
+
+	else:
+
+		writer = csv.DictWriter(output, fieldnames = FIELDS)
+
+		writer.writeheader()
+
+		for result in run(args.sizes, args.repeat):
+
+			writer.writerow(result)
+
+			output.flush()
+
+	if output is not sys.stdout:
+
+		output.close()
+
+################################################################################
+
+if __name__ == '__main__':
+
+	main()
+
+################################################################################
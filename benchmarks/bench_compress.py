@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import argparse
+import pathlib
+import timeit
+import sys
+
+from uuid import uuid4
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from eccpacket import eccPacket
+
+################################################################################
+
+TAG = 'BImGKLu0cwgmRigdvoWTnJdQ0Q+QgscUzJgsdChUOTi2dkM6wF/KXf84w9VjIydfIwl3EDgNPvjLP3HgNyifZ9w='
+
+CODE = '''def refresh(self):
+
+	self.blocks = self.proxy.getblockcount()
+
+	self.peers  = self.proxy.getconnectioncount()
+'''
+
+COW = r''' ________________
+< Hello ecchat ! >
+ ----------------
+        \   ^__^
+         \  (oo)\_______
+            (__)\       )\/\
+                ||----w |
+                ||     ||
+'''
+
+SAMPLES = {'short'     : 'Hi - are you there ?',
+		   'sentence'  : 'Sending the ECC for the swap now, should confirm within a couple of blocks.',
+		   'paragraph' : ' '.join(['The quick brown fox jumps over the lazy dog.'] * 8),
+		   'code'      : CODE * 3,
+		   'cowsay'    : COW}
+
+################################################################################
+
+def main():
+
+	argparser = argparse.ArgumentParser(description='chatMsg payload compression savings and cost')
+
+	argparser.add_argument('-n', '--number', action='store', help='iterations per test', type=int, default=5000, required=False)
+
+	number = argparser.parse_args().number
+
+	# Bytes on the wire are those of the hex encoded getbuffer entries
+
+	print('{:10} {:>6} {:>6} {:>6} {:>7} {:>9} {:>9}'.format('payload', 'json', 'cmpct', 'zlib', 'saving', 'enc us', 'dec us'))
+
+	for name, text in SAMPLES.items():
+
+		packet = eccPacket(1, 1, TAG, TAG, eccPacket.METH_chatMsg, {'uuid' : str(uuid4()), 'cmmd' : 'add', 'text' : text})
+
+		j = packet.to_json()
+		c = packet.to_compact()
+		z = packet.to_compressed()
+
+		assert eccPacket.from_message(z).packet == packet.packet
+
+		enc_z = timeit.timeit(packet.to_compressed, number = number) / number * 1e6
+		dec_z = timeit.timeit(lambda: eccPacket.from_message(z), number = number) / number * 1e6
+
+		print('{:10} {:6d} {:6d} {:6d} {:6.1f}% {:9.2f} {:9.2f}'.format(name, 2 * len(j), 2 * len(c), 2 * len(z), 100.0 * (1 - len(z) / len(j)), enc_z, dec_z))
+
+################################################################################
+
+if __name__ == '__main__':
+
+	main()
+
+################################################################################
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import argparse
+import codecs
+import pathlib
+import random
+import json
+import time
+import sys
+
+from uuid import uuid4
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from eccpacket import eccPacket
+
+################################################################################
+
+TAG = 'BImGKLu0cwgmRigdvoWTnJdQ0Q+QgscUzJgsdChUOTi2dkM6wF/KXf84w9VjIydfIwl3EDgNPvjLP3HgNyifZ9w='
+
+################################################################################
+
+def sample_packet():
+
+	# Traffic is mostly chat messages and their acknowledgements
+
+	meth = random.choice([eccPacket.METH_chatMsg] * 4 + [eccPacket.METH_chatAck] * 4 + [eccPacket.METH_addrRes])
+
+	if meth == eccPacket.METH_chatMsg:
+
+		data = {'uuid' : str(uuid4()), 'cmmd' : 'add', 'text' : 'x' * random.randint(5, 120)}
+
+	elif meth == eccPacket.METH_chatAck:
+
+		data = {'uuid' : str(uuid4()), 'cmmd' : 'add', 'able' : True}
+
+	else:
+
+		data = {'uuid' : str(uuid4()), 'coin' : 'ecc', 'addr' : 'EdVsHRhaQqcq5U5Yw4UAeB6yhN1gf3ddQi'}
+
+	return eccPacket(1, 1, TAG, TAG, meth, data)
+
+################################################################################
+
+def sample_buffer(size, compact):
+
+	# getbuffer returns a dict of hex encoded packet strings
+
+	buffer = {}
+
+	for index in range(size):
+
+		packet = sample_packet()
+
+		message = packet.to_compact() if compact else packet.to_json()
+
+		buffer[str(index)] = codecs.encode(message.encode(), 'hex').decode()
+
+	return buffer
+
+################################################################################
+
+class legacyPacket():
+
+	# Frozen copy of eccPacket as it was before decode_buffer, so that the legacy figures stay the baseline
+
+	METH_SET = ['chatMsg', 'chatAck', 'addrReq', 'addrRes', 'txidInf', 'swapInf', 'swapReq', 'swapRes']
+
+	KEY_LIST = {'chatMsg' : ('uuid', 'cmmd', 'text'),
+				'chatAck' : ('uuid', 'cmmd', 'able'),
+				'addrReq' : ('uuid', 'coin', 'type'),
+				'addrRes' : ('uuid', 'coin', 'addr'),
+				'txidInf' : ('uuid', 'coin', 'amnt', 'addr', 'txid'),
+				'swapInf' : ('uuid', 'cogv', 'amgv', 'cotk', 'amtk'),
+				'swapReq' : ('uuid', 'cogv', 'adgv'),
+				'swapRes' : ('uuid', 'cotk', 'adtk')}
+
+	def __init__(self, _id = '', _ver = '', _to = '', _from = '', _meth = '', _data = ''):
+
+		assert isinstance(_data, dict)
+
+		assert _meth in self.METH_SET
+
+		assert all(key in _data for key in self.KEY_LIST[_meth])
+
+		self.packet = {	'id'	: _id,
+						'ver'	: _ver,
+						'to'	: _to,
+						'from'	: _from,
+						'meth'	: _meth,
+						'data'	: _data}
+
+	@classmethod
+
+	def from_json(cls, json_string = ''):
+
+		d = json.loads(json_string)
+
+		return cls(d['id'], d['ver'], d['to'], d['from'], d['meth'], d['data'])
+
+	def get_data(self):
+
+		data = self.packet['data']
+
+		assert isinstance(data, dict)
+
+		assert self.packet['meth'] in self.METH_SET
+
+		assert all(key in data for key in self.KEY_LIST[self.packet['meth']])
+
+		return data
+
+################################################################################
+
+def legacy_decode(eccbuffer):
+
+	# The decode path used before eccPacket.decode_buffer, as in the zmqHandler of the time
+
+	packets = []
+
+	for packet in eccbuffer.values():
+
+		message = codecs.decode(packet, 'hex').decode()
+
+		ecc_packet = legacyPacket.from_json(message)
+
+		packets.append(ecc_packet)
+
+		ecc_packet.get_data()
+
+	return packets
+
+################################################################################
+
+def direct_decode(eccbuffer):
+
+	packets = []
+
+	for ecc_packet in eccPacket.decode_buffer(eccbuffer):
+
+		packets.append(ecc_packet)
+
+		ecc_packet.get_data()
+
+	return packets
+
+################################################################################
+
+def rate(decode, buffers, repeat):
+
+	# Best of several runs, to keep scheduler noise out of the figures
+
+	best = 0.0
+
+	for _ in range(repeat):
+
+		start = time.perf_counter()
+
+		count = sum(len(decode(buffer)) for buffer in buffers)
+
+		best = max(best, count / (time.perf_counter() - start))
+
+	return best
+
+################################################################################
+
+def main():
+
+	argparser = argparse.ArgumentParser(description='getbuffer to eccPacket decode throughput')
+
+	argparser.add_argument('-b', '--buffers', action='store', help='buffers per test'   , type=int, default=500, required=False)
+	argparser.add_argument('-s', '--size'   , action='store', help='packets per buffer', type=int, default=32 , required=False)
+	argparser.add_argument('-r', '--repeat' , action='store', help='runs per test'     , type=int, default=5  , required=False)
+
+	args = argparser.parse_args()
+
+	random.seed(1)
+
+	json_buffers    = [sample_buffer(args.size, False) for _ in range(args.buffers)]
+	compact_buffers = [sample_buffer(args.size, True ) for _ in range(args.buffers)]
+
+	print('{:24} {:>12}'.format('decode path', 'packets/sec'))
+
+	print('{:24} {:12.0f}'.format('legacy json', rate(legacy_decode, json_buffers, args.repeat)))
+	print('{:24} {:12.0f}'.format('direct json', rate(direct_decode, json_buffers, args.repeat)))
+	print('{:24} {:12.0f}'.format('direct compact', rate(direct_decode, compact_buffers, args.repeat)))
+
+################################################################################
+
+if __name__ == '__main__':
+
+	main()
+
+################################################################################
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import argparse
+import codecs
+import pathlib
+import timeit
+import sys
+
+from uuid import uuid4
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from eccpacket import eccPacket
+
+################################################################################
+
+TAG = 'BImGKLu0cwgmRigdvoWTnJdQ0Q+QgscUzJgsdChUOTi2dkM6wF/KXf84w9VjIydfIwl3EDgNPvjLP3HgNyifZ9w='
+
+SAMPLES = {eccPacket.METH_chatMsg : {'uuid' : str(uuid4()), 'cmmd' : 'add', 'text' : 'Hello there - how are you doing today ?'},
+		   eccPacket.METH_chatAck : {'uuid' : str(uuid4()), 'cmmd' : 'add', 'able' : True},
+		   eccPacket.METH_addrRes : {'uuid' : str(uuid4()), 'coin' : 'ecc', 'addr' : 'EdVsHRhaQqcq5U5Yw4UAeB6yhN1gf3ddQi'},
+		   eccPacket.METH_txidInf : {'uuid' : str(uuid4()), 'coin' : 'ecc', 'amnt' : '10.0', 'addr' : 'EdVsHRhaQqcq5U5Yw4UAeB6yhN1gf3ddQi', 'txid' : '9c2b1f0e' * 8}}
+
+################################################################################
+
+def measure(number, statement):
+
+	return timeit.timeit(statement, number = number) / number * 1e6
+
+################################################################################
+
+def main():
+
+	argparser = argparse.ArgumentParser(description='eccPacket wire encoding benchmark')
+
+	argparser.add_argument('-n', '--number', action='store', help='iterations per test', type=int, default=20000, required=False)
+
+	number = argparser.parse_args().number
+
+	print('{:8} {:>6} {:>6} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9}'.format('meth', 'json', 'cmpct', 'hex j', 'hex c', 'enc j us', 'enc c us', 'dec j us', 'dec c us'))
+
+	for meth, data in SAMPLES.items():
+
+		packet = eccPacket(1, 1, TAG, TAG, meth, data)
+
+		j = packet.to_json()
+		c = packet.to_compact()
+
+		assert eccPacket.from_message(c).packet == packet.packet
+
+		# eccoind returns packet buffers hex encoded, doubling the bytes handled on receipt
+
+		hex_j = len(codecs.encode(j.encode(), 'hex'))
+		hex_c = len(codecs.encode(c.encode(), 'hex'))
+
+		print('{:8} {:6d} {:6d} {:6d} {:6d} {:9.2f} {:9.2f} {:9.2f} {:9.2f}'.format(meth, len(j), len(c), hex_j, hex_c,
+			measure(number, packet.to_json),
+			measure(number, packet.to_compact),
+			measure(number, lambda: eccPacket.from_message(j)),
+			measure(number, lambda: eccPacket.from_message(c))))
+
+################################################################################
+
+if __name__ == '__main__':
+
+	main()
+
+################################################################################
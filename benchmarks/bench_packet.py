@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import argparse
+import tracemalloc
+import pathlib
+import timeit
+import json
+import sys
+
+from uuid import uuid4
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from eccpacket import eccPacket
+
+################################################################################
+## legacyPacket class ##########################################################
+################################################################################
+
+class legacyPacket():
+
+	# The dict based eccPacket, kept here as the baseline
+
+	METH_SET = ['chatMsg', 'chatAck', 'addrReq', 'addrRes', 'txidInf', 'swapInf', 'swapReq', 'swapRes']
+
+	KEY_LIST = eccPacket.KEY_LIST
+
+	def __init__(self, _id = '', _ver = '', _to = '', _from = '', _meth = '', _data = ''):
+
+		assert isinstance(_data, dict)
+
+		assert _meth in self.METH_SET
+
+		assert all(key in _data for key in self.KEY_LIST[_meth])
+
+		self.packet = {	'id'	: _id,
+						'ver'	: _ver,
+						'to'	: _to,
+						'from'	: _from,
+						'meth'	: _meth,
+						'data'	: _data}
+
+	def get_data(self):
+
+		data = self.packet['data']
+
+		assert isinstance(data, dict)
+
+		assert self.packet['meth'] in self.METH_SET
+
+		assert all(key in data for key in self.KEY_LIST[self.packet['meth']])
+
+		return data
+
+################################################################################
+
+TAG = 'BImGKLu0cwgmRigdvoWTnJdQ0Q+QgscUzJgsdChUOTi2dkM6wF/KXf84w9VjIydfIwl3EDgNPvjLP3HgNyifZ9w='
+
+################################################################################
+
+def sample_dicts(count):
+
+	# Late methods in the list cost the legacy class the most in its linear search
+
+	return [json.loads(json.dumps({'id' : 1, 'ver' : 2, 'to' : TAG, 'from' : TAG, 'meth' : 'swapRes',
+								   'data' : {'uuid' : str(uuid4()), 'cotk' : 'ecc', 'adtk' : 'EdVsHRhaQqcq5U5Yw4UAeB6yhN1gf3ddQi'}}))
+			for _ in range(count)]
+
+################################################################################
+
+def build(cls, dicts):
+
+	return [cls(d['id'], d['ver'], d['to'], d['from'], d['meth'], d['data']) for d in dicts]
+
+################################################################################
+
+def memory(cls, dicts):
+
+	# Only the packet objects are counted - the decoded dicts exist beforehand
+
+	tracemalloc.start()
+
+	packets = build(cls, dicts)
+
+	(size, _) = tracemalloc.get_traced_memory()
+
+	tracemalloc.stop()
+
+	return size / len(packets)
+
+################################################################################
+
+def validation(cls, dicts, number):
+
+	# Construction plus one get_data() - the validation a received packet goes through
+
+	def run():
+
+		for packet in build(cls, dicts):
+
+			packet.get_data()
+
+	return min(timeit.repeat(run, number = number, repeat = 5)) / number / len(dicts) * 1e6
+
+################################################################################
+
+def main():
+
+	argparser = argparse.ArgumentParser(description='eccPacket memory and validation cost against the legacy class')
+
+	argparser.add_argument('-c', '--count' , action='store', help='packets per test'  , type=int, default=10000, required=False)
+	argparser.add_argument('-n', '--number', action='store', help='iterations per test', type=int, default=5    , required=False)
+
+	args = argparser.parse_args()
+
+	dicts = sample_dicts(args.count)
+
+	print('{:14} {:>14} {:>18}'.format('class', 'bytes/packet', 'validate us/packet'))
+
+	for cls in (legacyPacket, eccPacket):
+
+		print('{:14} {:14.1f} {:18.3f}'.format(cls.__name__, memory(cls, dicts), validation(cls, dicts, args.number)))
+
+################################################################################
+
+if __name__ == '__main__':
+
+	main()
+
+################################################################################
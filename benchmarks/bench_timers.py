@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import argparse
+import platform
+import pathlib
+import random
+import json
+import time
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from zmqeventloop import alarmHeap, timerWheel
+
+################################################################################
+
+BACKENDS = {'heap'  : lambda clock: alarmHeap(clock = clock),
+			'wheel' : lambda clock: timerWheel(clock = clock)}
+
+################################################################################
+
+class fakeClock():
+
+	# Time only moves when the benchmark says so, so that every backend sees the same expiries
+
+	def __init__(self):
+
+		self.now = 0.0
+
+	def __call__(self):
+
+		return self.now
+
+################################################################################
+
+def rate(count, seconds):
+
+	return round(count / max(seconds, 1e-9), 1)
+
+################################################################################
+
+def run(backend, timers, span, step):
+
+	clock  = fakeClock()
+	alarms = BACKENDS[backend](clock)
+	delays = [random.uniform(0, span) for _ in range(timers)]
+	fired  = []
+
+	# Insert the pending timers, as one per packet awaiting an answer
+
+	start   = time.perf_counter()
+	handles = [alarms.add(delay, fired.append) for delay in delays]
+	add     = time.perf_counter() - start
+
+	# Cancel half, as answers arrive, and put them back again
+
+	cancelled = handles[::2]
+
+	start = time.perf_counter()
+
+	for handle in cancelled:
+
+		alarms.cancel(handle)
+
+	cancel = time.perf_counter() - start
+
+	for delay in delays[::2]:
+
+		alarms.add(delay, fired.append)
+
+	# Advance the clock in steps until every timer has run
+
+	start = time.perf_counter()
+	polls = 0
+
+	while len(alarms):
+
+		clock.now += step
+
+		for handle in alarms.pop_due():
+
+			alarms.take(handle)(None)
+
+		polls += 1
+
+	expire = time.perf_counter() - start
+
+	return {'backend'        : backend,
+			'timers'         : timers,
+			'add_per_sec'    : rate(timers, add),
+			'cancel_per_sec' : rate(len(cancelled), cancel),
+			'expire_per_sec' : rate(len(fired), expire),
+			'expire_ms'      : round(1000 * expire, 1),
+			'polls'          : polls}
+
+################################################################################
+
+def main():
+
+	argparser = argparse.ArgumentParser(description='alarm backend throughput with many pending timers')
+
+	argparser.add_argument('-n', '--timers'  , action='store', help='pending timers'              , type=int  , default=100000                                           , required=False)
+	argparser.add_argument('-s', '--span'    , action='store', help='timers due within (s)'       , type=float, default=60.0                                             , required=False)
+	argparser.add_argument('-t', '--step'    , action='store', help='clock step between polls (s)', type=float, default=0.01                                             , required=False)
+	argparser.add_argument('-r', '--repeat'  , action='store', help='runs per backend'            , type=int  , default=3                                                , required=False)
+	argparser.add_argument('-b', '--backends', action='store', help='backends to run'             , type=str  , default=list(BACKENDS), choices=list(BACKENDS), nargs='+', required=False)
+
+	args = argparser.parse_args()
+
+	results = []
+
+	for backend in args.backends:
+
+		# Best of several runs for each measure
+
+		runs = []
+
+		for seed in range(args.repeat):
+
+			random.seed(seed)
+
+			runs.append(run(backend, args.timers, args.span, args.step))
+
+		best = runs[0]
+
+		for key in ('add_per_sec', 'cancel_per_sec', 'expire_per_sec'):
+
+			best[key] = max(result[key] for result in runs)
+
+		best['expire_ms'] = min(result['expire_ms'] for result in runs)
+
+		results.append(best)
+
+	json.dump({'python'  : platform.python_version(),
+			   'machine' : platform.machine(),
+			   'span'    : args.span,
+			   'step'    : args.step,
+			   'repeat'  : args.repeat,
+			   'results' : results}, sys.stdout, indent = 1)
+
+	sys.stdout.write('\n')
+
+################################################################################
+
+if __name__ == '__main__':
+
+	main()
+
+################################################################################
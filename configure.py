@@ -5,7 +5,7 @@ import configparser
 import pathlib
 import sys
 
-from cryptonode import cryptoNode, eccoinNode, bitcoinNode, moneroNode, cryptoNodeException
+from cryptonode import cryptoNode, eccoinNode, cryptoNodeException, backend_family, load_backend
 
 ################################################################################
 
@@ -25,7 +25,7 @@ def getEccoinDataDir():
 
 ################################################################################
 
-def loadConfigurationECC(coins, protocol_id):
+def loadConfigurationECC(coins, protocol_id, node_class = eccoinNode):
 
 	rpcCheckKeys = {'rpcconnect', 'rpcport', 'rpcuser', 'rpcpassword'}
 
@@ -49,7 +49,7 @@ def loadConfigurationECC(coins, protocol_id):
 
 		rpc_address = '{}:{}'.format(parser['default']['rpcconnect'], parser['default']['rpcport'])
 
-		coins.append(eccoinNode('ecc', rpc_address, parser['default']['rpcuser'], parser['default']['rpcpassword'], protocol_id))
+		coins.append(node_class('ecc', rpc_address, parser['default']['rpcuser'], parser['default']['rpcpassword'], protocol_id))
 
 		return True
 
@@ -63,8 +63,6 @@ def loadConfigurationECC(coins, protocol_id):
 
 def loadConfigurationAlt(coins, conf):
 
-	rpcCheckKeys = {'rpcconnect', 'rpcport', 'rpcuser', 'rpcpassword'}
-
 	parser = configparser.ConfigParser()
 
 	try:
@@ -81,27 +79,27 @@ def loadConfigurationAlt(coins, conf):
 
 	for symbol in parser.sections():
 
-		if all (key in parser[symbol] for key in rpcCheckKeys):
+		try:
 
-			rpc_address = '{}:{}'.format(parser[symbol]['rpcconnect'], parser[symbol]['rpcport'])
+			node_class = load_backend(backend_family(symbol, parser[symbol]))
 
-			if symbol == 'xmr':
+		except (cryptoNodeException, ImportError) as error:
 
-				rpc_daemon  = '{}:{}'.format(parser[symbol]['daemonconnect'], parser[symbol]['daemonport'])
+			print('{} : {}'.format(symbol, str(error)))
 
-				try:
+			return False
 
-					coins.append(moneroNode(symbol, rpc_address, rpc_daemon, parser[symbol]['rpcuser'], parser[symbol]['rpcpassword']))
+		if all (key in parser[symbol] for key in node_class.config_keys):
 
-				except cryptoNodeException as error:
+			try:
 
-					print(str(error))
+				coins.append(node_class.from_config(symbol, parser[symbol]))
 
-					return False
+			except cryptoNodeException as error:
 
-			else:
+				print(str(error))
 
-				coins.append(bitcoinNode(symbol, rpc_address, parser[symbol]['rpcuser'], parser[symbol]['rpcpassword']))
+				return False
 
 	return True
 
@@ -113,6 +111,9 @@ def createTemplateAltConf(conf):
 				'# \n',
 				'# Note - Do not add your ecc config here. It is read directly from eccoin.conf\n',
 				'# \n',
+				'# The optional family key selects the node backend : bitcoin (default) or monero\n',
+				'# It defaults to monero for the xmr section\n',
+				'# \n',
 				'# [btc]\n',
 				'# rpcuser=username\n',
 				'# rpcpassword=password\n',
@@ -126,6 +127,7 @@ def createTemplateAltConf(conf):
 				'# rpcconnect=127.0.0.1\n',
 				'# \n',
 				'# [xmr]\n',
+				'# family=monero\n',
 				'# rpcuser=username\n',
 				'# rpcpassword=password\n',
 				'# rpcport=18082\n',
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 # coding: UTF-8
 
+import importlib
+import threading
+import pathlib
+import pickle
 import pycurl
-import requests
 
+from datetime  import datetime
 from itertools import count
 
 # RPC interface for Bitcoin type nodes
@@ -11,14 +15,6 @@ from itertools import count
 from slickrpc import Proxy
 from slickrpc import exc
 
-# RPC interface for Monero type nodes
-
-from monero.wallet import Wallet
-from monero.daemon import Daemon
-from monero.transaction import PaymentFilter
-
-import monero.exceptions
-
 ################################################################################
 ## cryptoNodeException class ###################################################
 ################################################################################
@@ -37,6 +33,8 @@ class cryptoNodeException(Exception):
 
 class cryptoNode():
 
+	config_keys = {'rpcconnect', 'rpcport', 'rpcuser', 'rpcpassword'}
+
 	############################################################################
 
 	def __init__(self, symbol, rpc_address, rpc_user, rpc_pass):
@@ -53,6 +51,16 @@ class cryptoNode():
 
 		self.zmqAddress  = ''
 
+		self.history     = None
+
+	############################################################################
+
+	@classmethod
+
+	def from_config(cls, symbol, section):
+
+		raise NotImplementedError
+
 	############################################################################
 
 	def __getattr__(self, method):
@@ -115,10 +123,350 @@ class cryptoNode():
 
 	############################################################################
 
+	def load_history(self):
+
+		if not self.history:
+
+			self.history = walletHistory(self.symbol)
+
+		return self.history
+
+	############################################################################
+
+	def sync_history(self):
+
+		# listsinceblock, as on Bitcoin type nodes - moneroNode has its own
+
+		history = self.load_history()
+
+		try:
+
+			if history.checkpoint:
+
+				result = self.proxy.listsinceblock(history.checkpoint)
+
+			else:
+
+				result = self.proxy.listsinceblock()
+
+		except exc.RpcInvalidAddressOrKey:
+
+			# Checkpoint block no longer known to the node - resync from scratch
+
+			history.reset()
+
+			result = self.proxy.listsinceblock()
+
+		except exc.RpcException as error:
+
+			raise cryptoNodeException('{} daemon returned error: {}'.format(self.symbol, str(error)))
+
+		history.merge_since_block(result)
+
+		return history
+
+	############################################################################
+
+	def start_fee_estimates(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
+	def get_fee_estimate(self):
+
+		raise NotImplementedError
+
+	############################################################################
+
 	def shutdown(self):
 
 		raise NotImplementedError
 
+################################################################################
+## walletHistory class #########################################################
+################################################################################
+
+class walletHistory():
+
+	# Local index of wallet transactions, stored per coin and synced incrementally
+	# from a checkpoint - a block hash for Bitcoin type nodes, a height for Monero
+
+	path = pathlib.Path('history')
+
+	############################################################################
+
+	def __init__(self, symbol):
+
+		self.symbol     = symbol
+		self.file       = self.path / '{}.dat'.format(symbol)
+
+		self.checkpoint = ''
+		self.records    = {}						# (txid, direction, index) -> record
+		self.keys       = {}						# txid -> keys of its records
+		self.changed    = False						# Whether there is anything new to save
+
+		self.load()
+
+	############################################################################
+
+	def load(self):
+
+		try:
+
+			with open(self.file, 'rb') as stream:
+
+				(self.checkpoint, self.records) = pickle.load(stream)
+
+		except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+
+			self.reset()
+
+			return
+
+		self.keys = {}
+
+		for key in self.records:
+
+			self.keys.setdefault(key[0], set()).add(key)
+
+	############################################################################
+
+	def save(self):
+
+		self.path.mkdir(parents=True, exist_ok=True)
+
+		temp = self.file.with_suffix('.tmp')
+
+		with open(temp, 'wb') as stream:
+
+			pickle.dump((self.checkpoint, self.records), stream)
+
+		temp.replace(self.file)
+
+		self.changed = False
+
+	############################################################################
+
+	def commit(self):
+
+		# Saving rewrites the whole history, so it is only done when something has changed
+
+		if self.changed:
+
+			self.save()
+
+	############################################################################
+
+	def reset(self):
+
+		self.checkpoint = ''
+		self.records    = {}
+		self.keys       = {}
+		self.changed    = True
+
+	############################################################################
+
+	def add(self, txid, direction, index, time_tx, amount, addr):
+
+		record = {'txid' : txid,
+				  'dirn' : direction,
+				  'time' : time_tx,
+				  'amnt' : amount,
+				  'addr' : addr}
+
+		# Transactions still unconfirmed are listed again on every sync
+
+		if self.records.get((txid, direction, index)) != record:
+
+			self.records[(txid, direction, index)] = record
+
+			self.keys.setdefault(txid, set()).add((txid, direction, index))
+
+			self.changed = True
+
+	############################################################################
+
+	def remove(self, txid):
+
+		for key in self.keys.pop(txid, ()):
+
+			del self.records[key]
+
+			self.changed = True
+
+	############################################################################
+
+	def advance(self, checkpoint):
+
+		if checkpoint != self.checkpoint:
+
+			self.checkpoint = checkpoint
+
+			self.changed = True
+
+	############################################################################
+
+	def merge_since_block(self, result):
+
+		for tx in result.get('removed', []):
+
+			self.remove(tx['txid'])
+
+		for tx in result['transactions']:
+
+			if tx['category'] in ('send', 'receive'):
+
+				direction = {'send' : 'TX', 'receive' : 'RX'} [tx['category']]
+
+				self.add(tx['txid'], direction, tx.get('vout', 0), datetime.fromtimestamp(tx['time']), abs(tx['amount']), tx.get('address', ''))
+
+		self.advance(result['lastblock'])
+
+		self.commit()
+
+	############################################################################
+
+	def txids(self):
+
+		return set(self.keys)
+
+	############################################################################
+
+	def transactions(self):
+
+		return sorted(self.records.values(), key = lambda record: record['time'])
+
+################################################################################
+## feeEstimator class ##########################################################
+################################################################################
+
+class feeEstimator():
+
+	# Caches the fee rate for a Bitcoin type node. The cache is refreshed by a
+	# background thread with its own RPC connection, as the pycurl handle of the
+	# node's proxy must not be shared between threads
+
+	conf_target = 6				# blocks
+	tx_size     = 0.25			# kB - typical transaction with one input and two outputs
+	interval    = 300			# seconds between refreshes when no blocks arrive
+
+	############################################################################
+
+	def __init__(self, symbol, service_url):
+
+		self.symbol      = symbol
+		self.service_url = service_url
+
+		self.feeRate     = None						# coin per kB - None until estimated
+		self.generation  = 0						# Advanced by invalidate, so that an estimate begun before is discarded
+		self.lock        = threading.Lock()
+		self.thread      = None
+		self.stopping    = False
+		self.wakeup      = threading.Event()
+
+	############################################################################
+
+	def start(self):
+
+		if not self.thread:
+
+			self.thread = threading.Thread(target = self.run, name = '{} fees'.format(self.symbol), daemon = True)
+
+			self.thread.start()
+
+	############################################################################
+
+	def run(self):
+
+		proxy = Proxy(self.service_url)
+
+		while not self.stopping:
+
+			generation = self.generation
+
+			feeRate = self.estimate(proxy)
+
+			with self.lock:
+
+				if generation == self.generation:
+
+					self.feeRate = feeRate
+
+			self.wakeup.wait(self.interval)
+
+			self.wakeup.clear()
+
+	############################################################################
+
+	def estimate(self, proxy):
+
+		try:
+
+			result = proxy.estimatesmartfee(self.conf_target)
+
+			if 'feerate' in result:
+
+				return result['feerate']
+
+		except exc.RpcMethodNotFound:
+
+			try:
+
+				result = proxy.estimatefee(self.conf_target)
+
+				if result > 0:
+
+					return result
+
+			except (exc.RpcException, pycurl.error, ValueError):
+
+				pass
+
+		except (exc.RpcException, pycurl.error, ValueError):
+
+			return None
+
+		# No estimate available yet - fall back to the minimum relay fee
+
+		try:
+
+			return proxy.getnetworkinfo()['relayfee']
+
+		except (exc.RpcException, pycurl.error, ValueError, KeyError):
+
+			return None
+
+	############################################################################
+
+	def invalidate(self):
+
+		with self.lock:
+
+			self.generation += 1
+
+			self.feeRate = None
+
+		self.wakeup.set()
+
+	############################################################################
+
+	def get_fee(self):
+
+		if self.feeRate is None:
+
+			return None
+
+		return self.feeRate * self.tx_size
+
+	############################################################################
+
+	def stop(self):
+
+		self.stopping = True
+
+		self.wakeup.set()
+
 ################################################################################
 ## eccoinNode class ############################################################
 ################################################################################
@@ -130,6 +478,12 @@ class eccoinNode(cryptoNode):
 
 	bufferIdx = count(start=1)
 
+	# getbuffer polling intervals used when packet notifications are unavailable
+
+	poll_min    = 0.2
+	poll_max    = 3.2
+	poll_factor = 2
+
 	############################################################################
 
 	def __init__(self, symbol, rpc_address, rpc_user, rpc_pass, protocol_id):
@@ -138,10 +492,15 @@ class eccoinNode(cryptoNode):
 
 		self.proxy = Proxy('http://%s:%s@%s' % (rpc_user, rpc_pass, rpc_address))
 
+		self.fees  = feeEstimator(self.symbol, 'http://%s:%s@%s' % (rpc_user, rpc_pass, rpc_address))
+
 		self.protocolId = protocol_id
 		self.routingTag = ''
 		self.bufferKey  = ''
 
+		self.zmqPackets   = False
+		self.pollInterval = self.poll_min
+
 	############################################################################
 
 	def __getattr__(self, method):
@@ -197,17 +556,33 @@ class eccoinNode(cryptoNode):
 
 			zmqnotifications = []
 
+		packetAddress = ''
+
 		for zmqnotification in zmqnotifications:
 
 			if zmqnotification['type'] == 'pubhashblock':
 
 				self.zmqAddress = zmqnotification['address']
 
+			if zmqnotification['type'] == 'pubpacket':
+
+				packetAddress = zmqnotification['address']
+
+		# Packet notifications are only received if published on the hashblock socket
+
+		self.zmqPackets = bool(packetAddress) and packetAddress == self.zmqAddress
+
 	############################################################################
 
 	def refresh(self):
 
-		self.blocks = self.proxy.getblockcount()
+		blocks = self.proxy.getblockcount()
+
+		if blocks != self.blocks:
+
+			self.fees.invalidate()
+
+		self.blocks = blocks
 		self.peers  = self.proxy.getconnectioncount()
 
 	############################################################################
@@ -292,6 +667,18 @@ class eccoinNode(cryptoNode):
 
 	############################################################################
 
+	def start_fee_estimates(self):
+
+		self.fees.start()
+
+	############################################################################
+
+	def get_fee_estimate(self):
+
+		return self.fees.get_fee()
+
+	############################################################################
+
 	def reset_buffer_timeout(self):
 
 		if self.bufferKey:
@@ -344,6 +731,28 @@ class eccoinNode(cryptoNode):
 
 	############################################################################
 
+	def poll_buffer(self):
+
+		eccbuffer = self.get_buffer(self.protocolId)
+
+		if eccbuffer:
+
+			self.pollInterval = self.poll_min
+
+		else:
+
+			self.pollInterval = min(self.poll_max, self.pollInterval * self.poll_factor)
+
+		return eccbuffer
+
+	############################################################################
+
+	def poll_reset(self):
+
+		self.pollInterval = self.poll_min
+
+	############################################################################
+
 	def shutdown(self):
 
 		if self.bufferKey:
@@ -354,6 +763,8 @@ class eccoinNode(cryptoNode):
 
 			self.bufferKey = ''
 
+		self.fees.stop()
+
 ################################################################################
 ## bitcoinNode class ###########################################################
 ################################################################################
@@ -368,6 +779,18 @@ class bitcoinNode(cryptoNode):
 
 		self.proxy = Proxy('http://%s:%s@%s' % (rpc_user, rpc_pass, rpc_address))
 
+		self.fees  = feeEstimator(self.symbol, 'http://%s:%s@%s' % (rpc_user, rpc_pass, rpc_address))
+
+	############################################################################
+
+	@classmethod
+
+	def from_config(cls, symbol, section):
+
+		rpc_address = '{}:{}'.format(section['rpcconnect'], section['rpcport'])
+
+		return cls(symbol, rpc_address, section['rpcuser'], section['rpcpassword'])
+
 	############################################################################
 
 	def __getattr__(self, method):
@@ -419,8 +842,14 @@ class bitcoinNode(cryptoNode):
 	############################################################################
 
 	def refresh(self):
-		
-		self.blocks = self.proxy.getblockcount()
+
+		blocks = self.proxy.getblockcount()
+
+		if blocks != self.blocks:
+
+			self.fees.invalidate()
+
+		self.blocks = blocks
 		self.peers  = self.proxy.getconnectioncount()
 
 	############################################################################
@@ -535,150 +964,80 @@ class bitcoinNode(cryptoNode):
 
 	############################################################################
 
-	def shutdown(self):
-
-		pass
-
-################################################################################
-## moneroNode class ############################################################
-################################################################################
-
-class moneroNode(cryptoNode):
-
-	############################################################################
-
-	def __init__(self, symbol, rpc_address, rpc_daemon, rpc_user, rpc_pass):
-
-		super().__init__(symbol, rpc_address, rpc_user, rpc_pass)
-
-		(host, port) = tuple(rpc_address.split(':'))
-
-		try:
-
-			self.wallet = Wallet(host=host, port=port, user=rpc_user, password=rpc_pass)
-
-		except monero.backends.jsonrpc.exceptions.Unauthorized:
-
-			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} wallet'.format(self.symbol))
-
-		except requests.exceptions.ConnectTimeout:
-
-			raise cryptoNodeException('Failed to connect - check that {} wallet is running'.format(self.symbol))
-
-		(host, port) = tuple(rpc_daemon.split(':'))
-
-		try:
-
-			self.daemon = Daemon(host=host, port=port)
-
-		except monero.backends.jsonrpc.exceptions.Unauthorized:
-
-			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} daemon'.format(self.symbol))
-
-		except requests.exceptions.ConnectTimeout:
-
-			raise cryptoNodeException('Failed to connect - check that {} daemon is running'.format(self.symbol))
-
-	############################################################################
-
-	def __getattr__(self, method):
-
-		return getattr(self.proxy, method)
+	def start_fee_estimates(self):
 
-		pass
+		self.fees.start()
 
 	############################################################################
 
-	def initialise(self):
+	def get_fee_estimate(self):
 
-		pass
+		return self.fees.get_fee()
 
 	############################################################################
 
-	def refresh(self):
-
-		try:
-
-			self.blocks = self.wallet.height()
-
-		except monero.backends.jsonrpc.exceptions.Unauthorized:
-
-			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} wallet'.format(self.symbol))
-
-		except requests.exceptions.ConnectTimeout:
-
-			raise cryptoNodeException('Failed to connect - check that {} wallet is running'.format(self.symbol))
-
-		try:
-
-			info = self.daemon.info()
-
-		except monero.backends.jsonrpc.exceptions.Unauthorized:
-
-			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} daemon'.format(self.symbol))
-
-		except requests.exceptions.ConnectTimeout:
-
-			raise cryptoNodeException('Failed to connect - check that {} daemon is running'.format(self.symbol))
+	def shutdown(self):
 
-		self.peers = info['incoming_connections_count'] + info['outgoing_connections_count']
+		self.fees.stop()
 
-	############################################################################
+################################################################################
+## Coin backend registry #######################################################
+################################################################################
 
-	def get_balance(self):
+# Backends are keyed by coin family and only imported when a configuration
+# section needs them, so the RPC libraries of unused families are never loaded
 
-		return self.wallet.balance()
+backends = {'bitcoin' : ('cryptonode', 'bitcoinNode'),
+			'monero'  : ('moneronode', 'moneroNode')}
 
-	############################################################################
+# Coin family assumed for a symbol when its section has no 'family' key
 
-	def get_unlocked_balance(self):
+families = {'xmr' : 'monero'}
 
-		return self.wallet.balance(unlocked=True)
-
-	############################################################################
-
-	def get_unconfirmed_balance(self):
+################################################################################
 
-		amount = 0.0
+def register_backend(family, module, name):
 
-		transfers = self.wallet._backend.transfers_in(0, PaymentFilter(unconfirmed=True, confirmed=False))
+	backends[family] = (module, name)
 
-		for transfer in transfers:
+################################################################################
 
-			amount += float(transfer.amount)
+def backend_family(symbol, section):
 
-		return amount
+	return section.get('family', families.get(symbol, 'bitcoin'))
 
-	############################################################################
+################################################################################
 
-	def get_new_address(self):
+def load_backend(family):
 
-		return str(self.wallet.address())
+	if family not in backends:
 
-	############################################################################
+		raise cryptoNodeException('No backend available for coin family : {}'.format(family))
 
-	def wallet_locked(self):
+	(module, name) = backends[family]
 
-		# Assume that wallet is unlocked when monero-wallet-rpc is started
+	return getattr(importlib.import_module(module), name)
 
-		return False
+################################################################################
+## Balance check ###############################################################
+################################################################################
 
-	############################################################################
+def balance_error(amount, balance, fee, label):
 
-	def unlock_wallet(self, passphrase, seconds):
+	# Why amount plus the estimated fee cannot be paid from balance, or None if it can - label names the amount
 
-		return True
+	if fee is None:
 
-	############################################################################
+		fee = 0.0
 
-	def send_to_address(self, address, amount, comment):
+	if amount + fee < balance:
 
-		return self.wallet.transfer(address, float(amount))[0].hash
+		return None
 
-	############################################################################
+	if fee:
 
-	def shutdown(self):
+		return '{} - must be less than current balance = {:f} less estimated fee = {:f}'.format(label, balance, fee)
 
-		pass
+	return '{} - must be less than current balance = {:f}'.format(label, balance)
 
 ################################################################################
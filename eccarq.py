@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import time
+import math
+
+from collections import OrderedDict
+from uuid        import uuid4
+
+################################################################################
+## eccRtt class ################################################################
+################################################################################
+
+class eccRtt():
+
+	# Smoothed round trip time to one peer and its variation, from which the
+	# retransmission timeout is derived as in RFC 6298
+
+	############################################################################
+
+	def __init__(self, initial = 3.0, minimum = 1.0, maximum = 60.0):
+
+		self.minimum = minimum
+		self.maximum = maximum
+
+		self.srtt    = None
+		self.rttvar  = None
+		self.rto     = initial
+		self.samples = 0
+
+	############################################################################
+
+	def sample(self, rtt):
+
+		self.samples += 1
+
+		if self.srtt is None:
+
+			self.srtt   = rtt
+			self.rttvar = rtt / 2
+
+		else:
+
+			self.rttvar = 0.75  * self.rttvar + 0.25  * abs(self.srtt - rtt)
+			self.srtt   = 0.875 * self.srtt   + 0.125 * rtt
+
+		self.rto = min(self.maximum, max(self.minimum, self.srtt + 4 * self.rttvar))
+
+	############################################################################
+
+	def timeout(self, attempt):
+
+		# The timeout doubles for each retransmission of the same packet
+
+		return min(self.maximum, self.rto * 2 ** attempt)
+
+################################################################################
+## eccArq class ################################################################
+################################################################################
+
+class eccArq():
+
+	# Packets that expect an answer are remembered, keyed by destination and
+	# (method, uuid), until the answer arrives. The timer starts when the
+	# packet actually leaves, rather than when it is queued. One not answered
+	# within the retransmission timeout is sent again, up to retries times,
+	# and then given up on. A destination that cannot take a repeat is given
+	# the longest timeout once instead. Only answers to packets sent once give
+	# an RTT sample, as an answer to a retransmitted packet could be to either
+	# copy
+
+	def __init__(self, schedule, cancel = None, retries = 4, peer_limit = 1024, repeats = None, clock = time.monotonic, **rtt):
+
+		self.schedule   = schedule					# schedule(delay, callback) returning a handle for cancel(handle)
+		self.cancel     = cancel
+		self.retries    = retries
+		self.repeats    = repeats or (lambda dest: True)	# repeats(dest) is False for a destination that would act on a repeat twice
+		self.peer_limit = peer_limit
+		self.clock      = clock
+		self.rtt_args   = rtt
+
+		self.peers   = OrderedDict()				# dest -> eccRtt, least recently used first
+		self.pending = {}							# (dest, key) -> [first sent, retransmissions, resend, give_up, timer or None until sent]
+
+		self.tracked     = 0
+		self.retransmits = 0
+		self.answered    = 0
+		self.failed      = 0
+
+	############################################################################
+
+	def rtt(self, dest):
+
+		if dest in self.peers:
+
+			self.peers.move_to_end(dest)
+
+		else:
+
+			self.peers[dest] = eccRtt(**self.rtt_args)
+
+			if len(self.peers) > self.peer_limit:
+
+				self.peers.popitem(last = False)
+
+		return self.peers[dest]
+
+	############################################################################
+
+	def track(self, dest, key, resend, give_up = None):
+
+		# Call once the packet is queued - resend() queues it again and give_up() is called if it is never answered
+
+		entry = [None, 0, resend, give_up, None]
+
+		if (old := self.pending.get((dest, key))) and old[4] is not None and self.cancel:
+
+			self.cancel(old[4])
+
+		self.pending[(dest, key)] = entry
+
+		self.tracked += 1
+
+	############################################################################
+
+	def sent(self, dest, key):
+
+		# Call as each packet leaves - starts the timer of a tracked packet not already waiting
+
+		if not (entry := self.pending.get((dest, key))) or entry[4] is not None:
+
+			return
+
+		if entry[0] is None:
+
+			entry[0] = self.clock()
+
+		attempt = entry[1] if self.repeats(dest) else self.retries
+
+		entry[4] = self.schedule(self.rtt(dest).timeout(attempt), lambda: self.expire(dest, key, entry))
+
+	############################################################################
+
+	def lost(self, dest, key):
+
+		# Call when a tracked packet could not be sent at all
+
+		if (entry := self.pending.pop((dest, key), None)):
+
+			self.give_up(entry)
+
+	############################################################################
+
+	def give_up(self, entry):
+
+		if entry[4] is not None and self.cancel:
+
+			self.cancel(entry[4])
+
+		self.failed += 1
+
+		if entry[3]:
+
+			entry[3]()
+
+	############################################################################
+
+	def expire(self, dest, key, entry):
+
+		# Without a cancel function timers are left to run - one for a packet since answered or tracked again finds a different entry
+
+		if self.pending.get((dest, key)) is not entry:
+
+			return
+
+		if entry[1] >= self.retries or not self.repeats(dest):
+
+			del self.pending[(dest, key)]
+
+			entry[4] = None
+
+			self.give_up(entry)
+
+			return
+
+		entry[1] += 1
+		entry[4]  = None
+
+		self.retransmits += 1
+
+		entry[2]()
+
+	############################################################################
+
+	def answer(self, dest, key):
+
+		# Returns True if the packet answered was still waiting
+
+		if not (entry := self.pending.pop((dest, key), None)):
+
+			return False
+
+		if entry[4] is not None and self.cancel:
+
+			self.cancel(entry[4])
+
+		if entry[1] == 0 and entry[0] is not None:
+
+			self.rtt(dest).sample(self.clock() - entry[0])
+
+		self.answered += 1
+
+		return True
+
+################################################################################
+## eccProbe class ##############################################################
+################################################################################
+
+class eccProbe():
+
+	# One run of /ping - the time each ping was sent, until its pong comes back,
+	# and the round trip times of those answered
+
+	def __init__(self, count, clock = time.monotonic):
+
+		self.uuid  = str(uuid4())
+		self.count = count
+		self.clock = clock
+
+		self.times    = {}							# seqn -> time sent, for pings not yet answered
+		self.rtts     = []
+		self.sent     = 0
+		self.reported = False
+
+	############################################################################
+
+	def send(self):
+
+		seqn = self.sent
+
+		self.times[seqn] = self.clock()
+
+		self.sent += 1
+
+		return seqn
+
+	############################################################################
+
+	def receive(self, seqn):
+
+		# Returns the round trip time, or None for a pong not waited for - or a malformed one, as seqn is from the wire
+
+		if not isinstance(seqn, int) or isinstance(seqn, bool) or seqn not in self.times:
+
+			return None
+
+		rtt = self.clock() - self.times.pop(seqn)
+
+		self.rtts.append(rtt)
+
+		return rtt
+
+	############################################################################
+
+	def done(self):
+
+		return self.sent == self.count and not self.times
+
+	############################################################################
+
+	def summary(self):
+
+		text = '{:d} sent, {:d} received, {:.0f}% loss'.format(self.sent, len(self.rtts), 100 * (self.sent - len(self.rtts)) / max(self.sent, 1))
+
+		if self.rtts:
+
+			rtts = sorted(self.rtts)
+
+			# p99 by the nearest rank method
+
+			p99 = rtts[math.ceil(0.99 * len(rtts)) - 1]
+
+			text += ', rtt min/avg/p99 = {:.1f}/{:.1f}/{:.1f} ms'.format(1000 * rtts[0], 1000 * sum(rtts) / len(rtts), 1000 * p99)
+
+		return text
+
+################################################################################
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import difflib
+import json
+import zlib
+
+################################################################################
+## eccDelta class ##############################################################
+################################################################################
+
+class eccDelta():
+
+	# An edit is sent as a list of [start, end, text] splices against the
+	# previous version, together with a checksum of that version so that the
+	# receiver can tell when it holds a different one
+
+	############################################################################
+
+	@staticmethod
+
+	def checksum(text):
+
+		return zlib.crc32(text.encode())
+
+	############################################################################
+
+	@classmethod
+
+	def diff(cls, old, new):
+
+		# Returns the extra chatMsg fields for the edit, or None where the full text is no larger
+
+		matcher = difflib.SequenceMatcher(None, old, new, autojunk = False)
+
+		splices = [[i1, i2, new[j1:j2]] for (tag, i1, i2, j1, j2) in matcher.get_opcodes() if tag != 'equal']
+
+		if len(json.dumps(splices)) + 12 >= len(json.dumps(new)):
+
+			return None
+
+		return {'base' : cls.checksum(old), 'diff' : splices}
+
+	############################################################################
+
+	@classmethod
+
+	def patch(cls, old, data):
+
+		if data['base'] != cls.checksum(old):
+
+			raise ValueError('Edit is against a different version of the message')
+
+		parts = []
+		start = 0
+
+		for (i1, i2, text) in data['diff']:
+
+			if not (isinstance(i1, int) and isinstance(i2, int) and isinstance(text, str)) or not start <= i1 <= i2 <= len(old):
+
+				raise ValueError('Malformed edit')
+
+			parts.append(old[start:i1])
+			parts.append(text)
+
+			start = i2
+
+		parts.append(old[start:])
+
+		return ''.join(parts)
+
+################################################################################
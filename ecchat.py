@@ -7,14 +7,15 @@ import pyqrcode
 import pathlib
 import logging
 import signal
-import codecs
 import pickle
+import pycurl
 import urwid
 import zmq
 import sys
 import re
 
-from uuid import uuid4
+from functools import partial
+from uuid      import uuid4
 
 # ZMQ event loop adapter for urwid
 
@@ -30,7 +31,12 @@ from configure import loadConfigurationECC, loadConfigurationAlt
 # eccPacket, cryptoNode & transaction classes
 
 from eccpacket    import eccPacket
-from cryptonode   import cryptoNode, eccoinNode, bitcoinNode, moneroNode, cryptoNodeException
+from eccinbound   import eccInboundQueue, eccReassembler, eccDedupCache
+from eccoutbound  import eccCoalescer, eccAckCollector, eccScheduler, eccBackoff, eccShaper
+from eccpeers     import eccPeerTable
+from eccdelta     import eccDelta
+from eccarq       import eccArq, eccProbe
+from cryptonode   import cryptoNode, eccoinNode, cryptoNodeException, balance_error
 from transactions import txSend, txReceive
 
 # urwid extension classes
@@ -51,6 +57,8 @@ class ChatApp:
 				('text'  , 'light gray'      , 'black'      , 'default' ),
 				('tnak'  , 'dark gray'       , 'black'      , 'default' ),
 				('tack'  , 'light gray'      , 'black'      , 'default' ),
+				('tretry', 'brown'           , 'black'      , 'default' ),
+				('tfail' , 'dark red'        , 'black'      , 'default' ),
 				('time'  , 'brown'           , 'black'      , 'default' ),
 				('self'  , 'light cyan'      , 'black'      , 'default' ),
 				('other' , 'light green'     , 'black'      , 'default' ),
@@ -60,14 +68,15 @@ class ChatApp:
 				('btn_nm', 'black'           , 'brown'      , 'default' ),
 				('btn_hl', 'black'           , 'yellow'     , 'standout')]
 
-	def __init__(self, name, other, tag, conf, debug=False):
+	def __init__(self, name, other, tag, conf, debug=False, rate=20.0, burst=40):
 
 		urwid.set_encoding('utf-8')
 
 		self.version      = '1.3'
 
 		self.protocol_id  = 1
-		self.protocol_ver = 1
+		self.protocol_ver = 2							# 2 and later understand helo
+		self.caps         = eccPacket.CAPS
 
 		self.party_name = ['ecchat', name, other]
 
@@ -100,8 +109,31 @@ class ChatApp:
 
 		self.txid = ''
 
+		self.block_window  = 0.5			# hashblock notifications are coalesced over this period
+		self.block_pending = set()
+		self.block_alarm_h = 0
+		self.block_notices = 0
+		self.block_updates = 0
+
+		self.ping_interval = 0.5			# /ping spacing, and how long to wait for the last pong
+		self.ping_timeout  = 10
+		self.ping_limit    = 1000
+
 		self.subscribers = []
 
+		self.inbound    = eccInboundQueue()
+		self.reassembly = eccReassembler()
+		self.dedup      = eccDedupCache()
+		self.peers      = eccPeerTable()
+		self.outbound   = eccCoalescer(self.transmit, self.call_later)
+		self.acks       = eccAckCollector(self.send_acks, self.call_later)
+		self.scheduler  = eccScheduler()
+		self.sending    = False				# send_queued is deferred
+		self.backoff    = eccBackoff()
+		self.shaper     = eccShaper(rate, burst)
+		self.arq        = eccArq(self.call_later, self.cancel_later, repeats = self.repeats)
+		self.probe      = None				# Latest /ping run
+
 		self.coins = []
 
 		self.txSend    = {}
@@ -150,13 +182,227 @@ class ChatApp:
 
 	def send_ecc_packet(self, meth, data):
 
-		ecc_packet = eccPacket(self.protocol_id, self.protocol_ver, self.otherTag, self.coins[0].routingTag, meth, data)
+		# Messages are batched into envelopes for peers that accept them
+
+		caps = self.peers.get(self.otherTag)
+
+		if eccPacket.CAP_envelope in caps:
+
+			# Acknowledgements waiting for the other party travel with this message
+
+			if eccPacket.CAP_acks in caps and (uuids := self.acks.take(self.otherTag)):
+
+				self.send_acks(self.otherTag, uuids)
+
+			self.outbound.put(self.otherTag, meth, data)
+
+		else:
+
+			self.transmit(self.otherTag, [(meth, data)])
+
+	############################################################################
+
+	def send_helo(self, resp = False):
+
+		self.send_ecc_packet(eccPacket.METH_helo, {'caps' : sorted(self.caps), 'resp' : resp})
+
+	############################################################################
+
+	def acknowledge(self, data):
+
+		if eccPacket.CAP_acks in self.peers.get(self.otherTag):
+
+			self.acks.put(self.otherTag, data['uuid'])
+
+		else:
+
+			rData = {'uuid' : data['uuid'],
+					 'cmmd' : data['cmmd'],
+					 'able' : True}
+
+			self.send_ecc_packet(eccPacket.METH_chatAck, rData)
+
+	############################################################################
+
+	def send_acks(self, dest, uuids):
+
+		self.outbound.put(dest, eccPacket.METH_chatAcks, {'uids' : uuids, 'able' : True})
+
+	############################################################################
+
+	def transmit(self, dest, messages):
+
+		if len(messages) == 1:
+
+			ecc_packet = eccPacket(self.protocol_id, self.protocol_ver, dest, self.coins[0].routingTag, *messages[0])
+
+		else:
+
+			ecc_packet = eccPacket.envelope(self.protocol_id, self.protocol_ver, dest, self.coins[0].routingTag, messages)
 
 		if self.debug:
 
 			logging.info('TX: {}'.format(ecc_packet.to_json()))
 
-		ecc_packet.send(self.coins[0])
+		priority = eccScheduler.priority(meth for (meth, data) in messages)
+
+		for message in ecc_packet.to_messages(self.peers.get(dest)):
+
+			self.scheduler.put(dest, priority, (ecc_packet, message))
+
+		# Sending waits until the current callback is done, so that everything it queued goes in priority order
+
+		if not self.sending:
+
+			self.sending = True
+
+			self.event_loop.defer(self.send_queued)
+
+	############################################################################
+
+	def send_queued(self, slice_size = 8):
+
+		for _ in range(slice_size):
+
+			if not self.shaper.ready() or not (item := self.scheduler.get(self.send_blocked())):
+
+				break
+
+			self.shaper.take(item[0])
+
+			self.send_item(*item)
+
+		if self.shaper.ready() and self.scheduler.ready(self.send_blocked()):
+
+			self.event_loop.defer(self.send_queued)
+
+		else:
+
+			self.sending = False
+
+			# Anything left is waiting out a backoff or for the rate limit
+
+			if self.scheduler:
+
+				self.call_later(min(delay for delay in (self.backoff.next_due(), self.shaper.next_due(), 1.0) if delay is not None), self.send_resume)
+
+		if not self.coins[0].zmqPackets:
+
+			self.buffer_poll_soon()
+
+	############################################################################
+
+	def send_blocked(self):
+
+		return self.backoff.blocked() | self.shaper.blocked()
+
+	############################################################################
+
+	def send_resume(self):
+
+		if not self.sending:
+
+			self.sending = True
+
+			self.send_queued()
+
+	############################################################################
+
+	def send_item(self, dest, priority, item, retry = True):
+
+		(ecc_packet, message) = item
+
+		try:
+
+			ecc_packet.send(self.coins[0], self.peers.get(dest), message)
+
+		except (cryptoNodeException, exc.RpcException, pycurl.error, OSError) as error:
+
+			if retry:
+
+				self.send_failed(dest, priority, item, error)
+
+			else:
+
+				logging.warning('Unable to send {} to {} : {}'.format(ecc_packet.get_meth(), dest, str(error)))
+
+			return False
+
+		if self.backoff.succeeded(dest):
+
+			self.walker.set_markup_styles(self.message_uuids(ecc_packet), 2, 'tnak')
+
+		# Retransmission timers start once the packet has actually left
+
+		for key in self.arq_keys(ecc_packet):
+
+			self.arq.sent(dest, key)
+
+		return True
+
+	############################################################################
+
+	def send_failed(self, dest, priority, item, error):
+
+		(ecc_packet, message) = item
+
+		if self.backoff.route_lost(error):
+
+			# Start route discovery now so that a route may be there by the time of the retry
+
+			try:
+
+				self.coins[0].setup_route(dest)
+
+			except (cryptoNodeException, exc.RpcException, pycurl.error, OSError):
+
+				pass
+
+		if self.backoff.failed(dest) is not None:
+
+			self.scheduler.requeue(dest, priority, item)
+
+			self.walker.set_markup_styles(self.message_uuids(ecc_packet), 2, 'tretry')
+
+		else:
+
+			# Give up on everything queued for this party, not just the packet that failed
+
+			uuids = self.message_uuids(ecc_packet)
+			keys  = self.arq_keys(ecc_packet)
+
+			for (dropped, message) in self.scheduler.drop(dest):
+
+				uuids.extend(self.message_uuids(dropped))
+				keys.extend(self.arq_keys(dropped))
+
+			self.walker.set_markup_styles(uuids, 2, 'tfail')
+
+			for key in keys:
+
+				self.arq.lost(dest, key)
+
+			self.append_message(0, 'Failed to send to {} : {}'.format(self.party_name[2], str(error)))
+
+	############################################################################
+
+	def message_uuids(self, ecc_packet):
+
+		return [packet.get_uuid() for packet in ecc_packet.unpack() if packet.get_meth() == eccPacket.METH_chatMsg]
+
+	############################################################################
+
+	def arq_keys(self, ecc_packet):
+
+		return [(packet.get_meth(), packet.get_uuid()) for packet in ecc_packet.unpack() if packet.get_meth() in (eccPacket.METH_chatMsg, eccPacket.METH_addrReq, eccPacket.METH_swapReq)]
+
+	############################################################################
+
+	def repeats(self, dest):
+
+		# Parties that predate helo show a repeated chatMsg twice, so only those that have advertised capabilities are sent repeats
+
+		return bool(self.peers.get(dest))
 
 	############################################################################
 
@@ -186,7 +432,9 @@ class ChatApp:
 
 	def delete_message(self, party, text, uuid = '', ack = True):
 
-		del_text = '\u2588' * len(text)
+		# A delete may carry only the uuid, in which case the text is already known
+
+		del_text = '\u2588' * len(text or self.walker.get_markup_text(uuid, 2))
 
 		tstyle = {True : self.party_text_style[party], False : 'tnak'} [ack]
 
@@ -198,9 +446,13 @@ class ChatApp:
 
 	############################################################################
 
-	def ack_message(self, uuid):
+	def ack_message(self, uuids):
+
+		for uuid in uuids:
+
+			self.arq.answer(self.otherTag, (eccPacket.METH_chatMsg, uuid))
 
-		self.walker.set_markup_style(uuid, 2, 'tack')
+		self.walker.set_markup_styles(uuids, 2, 'tack')
 
 	############################################################################
 
@@ -240,10 +492,78 @@ class ChatApp:
 
 	def block_refresh(self, index):
 
+		self.block_updates += 1
+
 		self.coins[index].refresh()
 
 	############################################################################
 
+	def call_later(self, delay, callback):
+
+		return self.loop.set_alarm_in(delay, lambda loop = None, data = None: callback())
+
+	############################################################################
+
+	def cancel_later(self, handle):
+
+		self.loop.remove_alarm(handle)
+
+	############################################################################
+
+	def block_notify(self, index):
+
+		self.block_notices += 1
+
+		self.block_pending.add(index)
+
+		if not self.block_alarm_h:
+
+			self.block_alarm_h = self.loop.set_alarm_in(self.block_window, self.block_refresh_pending)
+
+	############################################################################
+
+	def block_refresh_pending(self, loop = None, data = None):
+
+		self.block_alarm_h = 0
+
+		for index in sorted(self.block_pending):
+
+			self.block_refresh(index)
+
+		self.block_pending.clear()
+
+	############################################################################
+
+	def buffer_poll(self, loop = None, data = None):
+
+		try:
+
+			self.process_buffer(self.coins[0].poll_buffer())
+
+		except (cryptoNodeException, exc.RpcException, pycurl.error, OSError) as error:
+
+			logging.warning('Error fetching buffer : {}'.format(str(error)))
+
+		finally:
+
+			self.buffer_poll_h = self.loop.set_alarm_in(self.coins[0].pollInterval, self.buffer_poll)
+
+	############################################################################
+
+	def buffer_poll_soon(self):
+
+		# A reply is likely after sending, so return to the fastest polling rate
+
+		if self.coins[0].pollInterval > self.coins[0].poll_min:
+
+			self.coins[0].poll_reset()
+
+			self.loop.remove_alarm(self.buffer_poll_h)
+
+			self.buffer_poll_h = self.loop.set_alarm_in(self.coins[0].pollInterval, self.buffer_poll)
+
+	############################################################################
+
 	def show_passphrase_dialog(self, symbol, retry_no, retry_max, callback):
 
 		dialog = PassphraseDialog(text = u'Enter {} wallet unlock passphrase ({:d}/{:d}):'.format(symbol, retry_no, retry_max), loop = self.loop)
@@ -295,9 +615,7 @@ class ChatApp:
 
 		balance = self.coins[indexGive].get_unlocked_balance()
 
-		if float_amountGive >= balance:
-
-			self.append_message(0, 'Invalid swap amount - must be less than current balance = {:f}'.format(balance))
+		if not self.check_balance(float_amountGive, balance, self.coins[indexGive].get_fee_estimate(), 'Invalid swap amount'):
 
 			return
 
@@ -327,7 +645,19 @@ class ChatApp:
 
 	############################################################################
 
-	def swap_proposed(self, symbolGive, amountGive, symbolTake, amountTake):
+	def check_balance(self, amount, balance, fee, label):
+
+		if error := balance_error(amount, balance, fee, label):
+
+			self.append_message(0, error)
+
+			return False
+
+		return True
+
+	############################################################################
+
+	def swap_proposed(self, uuid, symbolGive, amountGive, symbolTake, amountTake):
 
 		# Notify user of swap proposal
 
@@ -387,14 +717,14 @@ class ChatApp:
 
 		balance = self.coins[indexTake].get_unlocked_balance()
 
-		if float_amountTake >= balance:
-
-			self.append_message(0, 'Invalid swap amount - must be less than current balance = {:f}'.format(balance))
+		if not self.check_balance(float_amountTake, balance, self.coins[indexTake].get_fee_estimate(), 'Invalid swap amount'):
 
 			return
 
+		# The swapReq carries the uuid of the swapInf, so that both parties know the swap by the same uuid
+
 		self.swap_pending    = True
-		self.swap_uuid       = ''
+		self.swap_uuid       = uuid
 		self.swap_timeout_h  = 0
 		self.swap_amountGive = float_amountGive
 		self.swap_amountTake = float_amountTake
@@ -423,7 +753,7 @@ class ChatApp:
 
 		self.send_ecc_packet(eccPacket.METH_swapReq, data)
 
-		self.loop.set_alarm_in(10, self.timeout_execute)
+		self.arq.track(self.otherTag, (eccPacket.METH_swapReq, self.swap_uuid), partial(self.send_ecc_packet, eccPacket.METH_swapReq, data), self.timeout_execute)
 
 	############################################################################
 
@@ -451,6 +781,8 @@ class ChatApp:
 
 			self.send_ecc_packet(eccPacket.METH_swapRes, data)
 
+		return data
+
 	############################################################################
 
 	def swap_response(self, symbolTake, addressTake):
@@ -535,6 +867,71 @@ class ChatApp:
 
 	############################################################################
 
+	def start_ping(self, count):
+
+		if self.probe and not self.probe.reported:
+
+			self.append_message(0, 'Ping already in progress')
+
+			return
+
+		# Parties that predate ping fail on it, and those that have sent a helo know it
+
+		if not self.peers.heard(self.otherTag):
+
+			self.append_message(0, '{} has not sent a helo, so may not understand ping'.format(self.party_name[2]))
+
+			return
+
+		self.probe = eccProbe(max(1, min(count, self.ping_limit)))
+
+		self.append_message(0, 'Pinging {} {:d} times'.format(self.party_name[2], self.probe.count))
+
+		self.send_ping(self.probe)
+
+	############################################################################
+
+	def send_ping(self, probe):
+
+		data = {'uuid' : probe.uuid,
+				'seqn' : probe.send()}
+
+		# Sent straight to the scheduler, as waiting to fill an envelope would add to the time measured
+
+		self.transmit(self.otherTag, [(eccPacket.METH_ping, data)])
+
+		if probe.sent < probe.count:
+
+			self.call_later(self.ping_interval, partial(self.send_ping, probe))
+
+		else:
+
+			self.call_later(self.ping_timeout, partial(self.ping_report, probe))
+
+	############################################################################
+
+	def ping_received(self, data):
+
+		if self.probe and data['uuid'] == self.probe.uuid and (rtt := self.probe.receive(data['seqn'])) is not None:
+
+			self.arq.rtt(self.otherTag).sample(rtt)
+
+			if self.probe.done():
+
+				self.ping_report(self.probe)
+
+	############################################################################
+
+	def ping_report(self, probe):
+
+		if not probe.reported:
+
+			probe.reported = True
+
+			self.append_message(0, 'Ping {} : {}'.format(self.party_name[2], probe.summary()))
+
+	############################################################################
+
 	def timeout_swap(self, loop = None, data = None):
 
 		if self.swap_pending:
@@ -585,10 +982,12 @@ class ChatApp:
 		self.append_message(0, '%-8s - %s' % ('/address <coin>', 'generate a new address'))
 		self.append_message(0, '%-8s - %s' % ('/send x  <coin>', 'send x to other party'))
 		self.append_message(0, '%-8s - %s' % ('/txid          ', 'display txid of last transaction'))
-		self.append_message(0, '%-8s - %s' % ('/list    <coin>', 'list all transactions this session'))
+		self.append_message(0, '%-8s - %s' % ('/list    <coin>', 'list wallet transactions'))
 		self.append_message(0, '%-8s - %s' % ('         <coin>', 'optional coin symbol - defaults to ecc'))
 		self.append_message(0, '%-8s - %s' % ('/swap x <coin-1> for y <coin-2>', 'proposes a swap'))
 		self.append_message(0, '%-8s - %s' % ('/execute       ', 'executes the proposed swap'))
+		self.append_message(0, '%-8s - %s' % ('/stats         ', 'display message and block statistics'))
+		self.append_message(0, '%-8s - %s' % ('/ping    [n]   ', 'measure round trip time to other party'))
 
 	############################################################################
 
@@ -641,6 +1040,12 @@ class ChatApp:
 
 					self.append_message(0, '{} : {:f}'.format(coin.symbol, balance_con))
 
+			fee = coin.get_fee_estimate()
+
+			if fee is not None:
+
+				self.append_message(0, '{} : estimated fee {:f}'.format(coin.symbol, fee))
+
 	############################################################################
 
 	def echo_qrcode(self, text):
@@ -670,20 +1075,70 @@ class ChatApp:
 
 	def echo_transactions(self, symbol):
 
+		valid, index = self.check_symbol(symbol)
+
+		try:
+
+			history = self.coins[index].sync_history()
+
+		except cryptoNodeException as error:
+
+			self.append_message(0, str(error))
+
+			return
+
+		for tx in history.transactions():
+
+			self.append_message(0, '{}: {} {} {:f} {} {}'.format(tx['dirn'], tx['time'].strftime('%x %X'), symbol, tx['amnt'], tx['addr'], tx['txid']))
+
+		# Transactions from this session the wallet has not reported yet
+
+		txids = history.txids()
+
 		for tx in self.txSend.values():
 
-			if tx.coin.symbol == symbol:
+			if tx.coin.symbol == symbol and tx.txid and tx.txid not in txids:
 
 				self.append_message(0, 'TX: {} {} {:f} {} {}'.format(tx.time_tx.strftime('%x %X'), tx.coin.symbol, tx.f_amount, tx.addr, tx.txid))
 
 		for tx in self.txReceive.values():
 
-			if tx.coin.symbol == symbol:
+			if tx.coin.symbol == symbol and tx.txid not in txids:
 
 				self.append_message(0, 'RX: {} {} {:f} {} {}'.format(tx.time_tx.strftime('%x %X'), tx.coin.symbol, tx.f_amount, tx.addr, tx.txid))
 
 	############################################################################
 
+	def echo_stats(self):
+
+		ratio = self.block_notices / self.block_updates if self.block_updates else 0.0
+
+		self.append_message(0, 'blocks   : {:d} notifications, {:d} refreshes ({:.1f}:1 coalesced)'.format(self.block_notices, self.block_updates, ratio))
+		self.append_message(0, 'inbound  : {:d} received, {:d} dropped, {:d} invalid, {:d} max queued'.format(self.inbound.received, self.inbound.dropped, self.inbound.invalid, self.inbound.depth))
+		self.append_message(0, 'outbound : {:d} batched messages in {:d} packets'.format(self.outbound.messages, self.outbound.packets))
+		self.append_message(0, 'fragment : {:d} received, {:d} messages, {:d} duplicate, {:d} expired, {:d} evicted'.format(self.reassembly.fragments, self.reassembly.messages, self.reassembly.duplicates, self.reassembly.expired, self.reassembly.evicted))
+		self.append_message(0, 'peer     : {}'.format(', '.join(sorted(self.peers.get(self.otherTag))) or 'no capabilities advertised'))
+		self.append_message(0, 'dedup    : {:d} lookups, {:d} duplicates, {:d} remembered'.format(self.dedup.lookups, self.dedup.hits, len(self.dedup.entries)))
+		self.append_message(0, 'queues   : ' + ', '.join('{} {:d} sent {:d} max queued'.format(name, self.scheduler.sent[index], self.scheduler.max_depth[index]) for index, name in enumerate(eccScheduler.PRIORITY_NAMES)) + ', {:d} max per party'.format(self.scheduler.max_dest))
+		self.append_message(0, 'shaper   : {:d} throttled at {:g}/s, {:d} throttled overall'.format(self.shaper.throttled, self.shaper.rate, self.shaper.throttled_total))
+		self.append_message(0, 'retries  : {:d} failed sends, {:d} recovered, {:d} abandoned'.format(self.backoff.failures, self.backoff.recovered, self.backoff.abandoned))
+		self.append_message(0, 'arq      : {:d} tracked, {:d} retransmitted, {:d} answered, {:d} unanswered, {}'.format(self.arq.tracked, self.arq.retransmits, self.arq.answered, self.arq.failed, self.rtt_text()))
+		self.append_message(0, 'acks     : {:d} uuids in {:d} chatAcks, {:d} piggybacked'.format(self.acks.messages, self.acks.packets + self.acks.piggybacked, self.acks.piggybacked))
+
+	############################################################################
+
+	def rtt_text(self):
+
+		rtt = self.arq.rtt(self.otherTag)
+
+		if rtt.srtt is None:
+
+			return 'rto {:.2f}s with no rtt measured'.format(rtt.rto)
+
+		return 'rtt {:.2f}s +/- {:.2f}s rto {:.2f}s'.format(rtt.srtt, rtt.rttvar, rtt.rto)
+
+	############################################################################
+
 	def process_user_entry(self, text):
 
 		if len(text) > 0:
@@ -877,6 +1332,22 @@ class ChatApp:
 
 				self.swap_execute()
 
+			elif text.startswith('/stats'):
+
+				self.echo_stats()
+
+			elif text.startswith('/ping'):
+
+				match = re.match('/ping( (?P<count>[0-9]+))?$', text)
+
+				if match:
+
+					self.start_ping(int(match.group('count') or 4))
+
+				else:
+
+					self.append_message(0, 'Unknown command syntax - try /help for a list of commands')
+
 			elif text.startswith('/txid'):
 
 				if self.txid:
@@ -922,6 +1393,8 @@ class ChatApp:
 
 				self.send_ecc_packet(eccPacket.METH_chatMsg, data)
 
+				self.arq.track(self.otherTag, (eccPacket.METH_chatMsg, uuid), partial(self.send_ecc_packet, eccPacket.METH_chatMsg, data), partial(self.walker.set_markup_styles, [uuid], 2, 'tfail'))
+
 	############################################################################
 
 	def process_user_replace(self, text):
@@ -930,6 +1403,8 @@ class ChatApp:
 
 			if uuid := self.walker.recall_uuid():
 
+				old_text = self.walker.get_markup_text(uuid, 2)
+
 				self.footerT.set_edit_text(u'')
 
 				self.replace_message(1, text, uuid, False)
@@ -938,6 +1413,14 @@ class ChatApp:
 						'cmmd' : 'replace',
 						'text' : text}
 
+				# Send only the changes where the other party can apply them and they are smaller
+
+				if eccPacket.CAP_delta in self.peers.get(self.otherTag) and (delta := eccDelta.diff(old_text, text)):
+
+					data.update(delta)
+
+					data['text'] = ''
+
 				self.send_ecc_packet(eccPacket.METH_chatMsg, data)
 
 			else:
@@ -958,7 +1441,7 @@ class ChatApp:
 
 				data = {'uuid' : uuid,
 						'cmmd' : 'delete',
-						'text' : text}
+						'text' : '' if eccPacket.CAP_delta in self.peers.get(self.otherTag) else text}
 
 				self.send_ecc_packet(eccPacket.METH_chatMsg, data)
 
@@ -972,6 +1455,50 @@ class ChatApp:
 
 			return
 
+		if ecc_packet.get_meth() == eccPacket.METH_helo:
+
+			data = ecc_packet.get_data()
+
+			self.peers.update(self.otherTag, data['caps'])
+
+			if not data['resp']:
+
+				self.send_helo(True)
+
+			return
+
+		# Greet the other party once it has shown that it understands helo
+
+		if ecc_packet.knows_helo() and self.peers.needs_helo(self.otherTag):
+
+			self.send_helo(False)
+
+		if ecc_packet.get_meth() == eccPacket.METH_ping:
+
+			self.transmit(self.otherTag, [(eccPacket.METH_pong, ecc_packet.get_data())])
+
+			return
+
+		if ecc_packet.get_meth() == eccPacket.METH_pong:
+
+			self.ping_received(ecc_packet.get_data())
+
+			return
+
+		if self.dedup.seen(ecc_packet):
+
+			# Only repeat the acknowledgement or reply, in case that is what went missing
+
+			if ecc_packet.get_meth() == eccPacket.METH_chatMsg:
+
+				self.acknowledge(ecc_packet.get_data())
+
+			elif reply := self.dedup.reply(ecc_packet):
+
+				self.send_ecc_packet(*reply)
+
+			return
+
 		if ecc_packet.get_meth() == eccPacket.METH_chatMsg:
 
 			data = ecc_packet.get_data()
@@ -982,23 +1509,57 @@ class ChatApp:
 
 			if data['cmmd'] == 'replace':
 
-				self.replace_message(2, data['text'], data['uuid'])
+				text = data['text']
+
+				if 'diff' in data:
+
+					try:
+
+						text = eccDelta.patch(self.walker.get_markup_text(data['uuid'], 2), data)
+
+					except (ValueError, KeyError, TypeError):
+
+						# Ask for the whole text instead
+
+						rData = {'uuid' : data['uuid'],
+								 'cmmd' : data['cmmd'],
+								 'able' : False}
+
+						self.send_ecc_packet(eccPacket.METH_chatAck, rData)
+
+						return
+
+				self.replace_message(2, text, data['uuid'])
 
 			if data['cmmd'] == 'delete':
 
 				self.delete_message(2, data['text'], data['uuid'])
 
-			rData = {'uuid' : data['uuid'],
-					 'cmmd' : data['cmmd'],
-					 'able' : True}
-
-			self.send_ecc_packet(eccPacket.METH_chatAck, rData)
+			self.acknowledge(data)
 
 		elif ecc_packet.get_meth() == eccPacket.METH_chatAck:
 
 			data = ecc_packet.get_data()
 
-			self.ack_message(data['uuid'])
+			if data['able']:
+
+				self.ack_message([data['uuid']])
+
+			elif data['cmmd'] == 'replace':
+
+				# The other party could not apply an edit - send it the whole text
+
+				rData = {'uuid' : data['uuid'],
+						 'cmmd' : 'replace',
+						 'text' : self.walker.get_markup_text(data['uuid'], 2)}
+
+				self.send_ecc_packet(eccPacket.METH_chatMsg, rData)
+
+		elif ecc_packet.get_meth() == eccPacket.METH_chatAcks:
+
+			data = ecc_packet.get_data()
+
+			self.ack_message(data['uids'])
 
 		elif ecc_packet.get_meth() == eccPacket.METH_addrReq:
 
@@ -1016,13 +1577,17 @@ class ChatApp:
 
 				self.send_ecc_packet(eccPacket.METH_addrRes, rData)
 
+				self.dedup.remember(ecc_packet, eccPacket.METH_addrRes, rData)
+
 		elif ecc_packet.get_meth() == eccPacket.METH_addrRes:
 
 			data = ecc_packet.get_data()
 
 			if 'uuid' in data:
 
-				if data['uuid'] in self.txSend:
+				# A late reply to a request already given up on is ignored
+
+				if self.arq.answer(self.otherTag, (eccPacket.METH_addrReq, data['uuid'])) and data['uuid'] in self.txSend:
 
 					self.txSend[data['uuid']].do_send(data['addr'])
 
@@ -1048,19 +1613,27 @@ class ChatApp:
 
 			data = ecc_packet.get_data()
 
-			self.swap_proposed(data['cogv'], data['amgv'], data['cotk'], data['amtk'])
+			self.swap_proposed(data['uuid'], data['cogv'], data['amgv'], data['cotk'], data['amtk'])
 
 		elif ecc_packet.get_meth() == eccPacket.METH_swapReq:
 
 			data = ecc_packet.get_data()
 
-			self.swap_request(data['cogv'], data['adgv'])
+			# Now that swapReq carries a uuid, a repeat of it is a duplicate and gets the same reply
+
+			self.dedup.remember(ecc_packet, eccPacket.METH_swapRes, self.swap_request(data['cogv'], data['adgv']))
 
 		elif ecc_packet.get_meth() == eccPacket.METH_swapRes:
 
 			data = ecc_packet.get_data()
 
-			self.swap_response(data['cotk'], data['adtk'])
+			# A refusal carries no uuid, and a reply to a repeated swapReq may arrive once the swap is over
+
+			if self.swap_pending:
+
+				self.arq.answer(self.otherTag, (eccPacket.METH_swapReq, self.swap_uuid))
+
+				self.swap_response(data['cotk'], data['adtk'])
 
 		else:
 
@@ -1120,6 +1693,16 @@ class ChatApp:
 
 		# TODO - send exit notification for all connected parties
 
+		self.acks.flush_all()
+
+		self.outbound.flush_all()
+
+		# One attempt each - there is no waiting out a backoff on the way out
+
+		while item := self.scheduler.get():
+
+			self.send_item(*item, retry = False)
+
 		raise urwid.ExitMainLoop()
 
 	############################################################################
@@ -1148,7 +1731,7 @@ class ChatApp:
 
 			slashdevslashnull = self.subscribers[index].recv_multipart(zmq.DONTWAIT)
 
-			self.block_refresh(index)
+			self.block_notify(index)
 
 			return
 
@@ -1156,27 +1739,53 @@ class ChatApp:
 		
 		if address.decode() == 'hashblock':
 
-			self.block_refresh(0)
+			self.block_notify(0)
 
 		if address.decode() == 'packet':
 
 			protocolID = contents.decode()[1:]
 
-			eccbuffer = self.coins[0].get_buffer(int(protocolID))
+			self.process_buffer(self.coins[0].get_buffer(int(protocolID)))
+
+	############################################################################
+
+	def process_buffer(self, eccbuffer):
 
-			if eccbuffer:
+		if eccbuffer:
 
-				for packet in eccbuffer.values():
+			draining = len(self.inbound) > 0
 
-					message = codecs.decode(packet, 'hex').decode()
+			for ecc_packet in self.reassembly.reassemble(eccPacket.decode_buffer(eccbuffer)):
+
+				if ecc_packet:
 
 					if self.debug:
 
-						logging.info('RX: {}'.format(message))
+						logging.info('RX: {}'.format(ecc_packet.to_json()))
+
+					self.inbound.put(ecc_packet)
+
+				else:
+
+					self.inbound.put_invalid()
 
-					ecc_packet = eccPacket.from_json(message)
+			if not draining:
 
-					self.process_ecc_packet(ecc_packet)
+				self.drain_buffer()
+
+	############################################################################
+
+	def drain_buffer(self):
+
+		for ecc_packet in self.inbound.get_slice():
+
+			self.process_ecc_packet(ecc_packet)
+
+		# Let the event loop redraw and poll input before handling the next slice
+
+		if self.inbound:
+
+			self.event_loop.defer(self.drain_buffer)
 
 	############################################################################
 
@@ -1202,6 +1811,7 @@ class ChatApp:
 
 					coin.initialise()
 					coin.refresh()
+					coin.start_fee_estimates()
 
 					if coin == self.coins[0]: # self.coins[0].symbol == 'ecc'
 
@@ -1247,6 +1857,12 @@ class ChatApp:
 
 			self.loop.set_alarm_in(10, self.block_refresh_timed)
 
+			# Without packet notifications from eccoind the buffer is polled instead
+
+			if not self.coins[0].zmqPackets:
+
+				self.buffer_poll_h = self.loop.set_alarm_in(self.coins[0].pollInterval, self.buffer_poll)
+
 			self.loop.run()
 
 			self.zmqShutdown()
@@ -1291,6 +1907,8 @@ def main():
 	argparser.add_argument('-t', '--tag'   , action='store',      help='routing tag (remote)', type=str, default = ''           , required=True )
 	argparser.add_argument('-c', '--conf'  , action='store',      help='configuration file'  , type=str, default = 'ecchat.conf', required=False)
 	argparser.add_argument('-d', '--debug' , action='store_true', help='debug message log'   ,                                    required=False)
+	argparser.add_argument('-r', '--rate'  , action='store',      help='max packets/s sent'  , type=float, default = 20.0     , required=False)
+	argparser.add_argument('-b', '--burst' , action='store',      help='max packets in burst', type=int, default = 40           , required=False)
 
 	command_line_args = argparser.parse_args()
 
@@ -1300,7 +1918,9 @@ def main():
 	              command_line_args.other,
 	              command_line_args.tag,
 	              command_line_args.conf,
-	              command_line_args.debug)
+	              command_line_args.debug,
+	              command_line_args.rate,
+	              command_line_args.burst)
 
 	app.run()
 
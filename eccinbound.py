@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import time
+
+from collections import OrderedDict, deque
+
+from eccpacket import eccPacket
+
+################################################################################
+## eccInboundQueue class #######################################################
+################################################################################
+
+class eccInboundQueue():
+
+	# Received packets are queued per sender and handed out in bounded slices,
+	# taking one packet from each sender in turn so that a flooding peer cannot
+	# starve the others
+
+	############################################################################
+
+	def __init__(self, slice_size = 16, sender_limit = 256, total_limit = 1024):
+
+		self.slice_size   = slice_size
+		self.sender_limit = sender_limit
+		self.total_limit  = total_limit
+
+		self.queues   = OrderedDict()				# sender -> deque of packets, in round robin order
+		self.count    = 0
+
+		self.received = 0
+		self.dropped  = 0
+		self.invalid  = 0
+		self.depth    = 0							# High water mark of self.count
+
+	############################################################################
+
+	def __len__(self):
+
+		return self.count
+
+	############################################################################
+
+	def put(self, ecc_packet):
+
+		self.received += 1
+
+		sender = ecc_packet.get_from()
+
+		if sender not in self.queues:
+
+			self.queues[sender] = deque()
+
+		queue = self.queues[sender]
+
+		if len(queue) >= self.sender_limit:
+
+			self.dropped += 1
+
+			return False
+
+		if self.count >= self.total_limit:
+
+			# Make room by dropping the oldest packet of the busiest sender
+
+			busiest = max(self.queues.values(), key = len)
+
+			busiest.popleft()
+
+			self.count   -= 1
+			self.dropped += 1
+
+		queue.append(ecc_packet)
+
+		self.count += 1
+
+		self.depth = max(self.depth, self.count)
+
+		return True
+
+	############################################################################
+
+	def put_invalid(self):
+
+		self.received += 1
+		self.invalid  += 1
+
+	############################################################################
+
+	def get_slice(self):
+
+		packets = []
+
+		while self.queues and len(packets) < self.slice_size:
+
+			(sender, queue) = next(iter(self.queues.items()))
+
+			if queue:
+
+				packets.append(queue.popleft())
+
+				self.count -= 1
+
+			if queue:
+
+				self.queues.move_to_end(sender)
+
+			else:
+
+				del self.queues[sender]
+
+		return packets
+
+################################################################################
+## eccReassembler class ########################################################
+################################################################################
+
+class eccReassembler():
+
+	# Fragments are held per (sender, uuid) until the message is complete. The
+	# memory held is capped by evicting the oldest partial message, and messages
+	# not completed within the timeout are discarded
+
+	############################################################################
+
+	def __init__(self, timeout = 60, byte_limit = 0x100000, message_limit = 64, fragment_limit = 1024, done_limit = 256, clock = time.monotonic):
+
+		self.timeout        = timeout
+		self.byte_limit     = byte_limit
+		self.message_limit  = message_limit
+		self.fragment_limit = fragment_limit
+		self.done_limit     = done_limit
+		self.clock          = clock
+
+		self.partial   = OrderedDict()				# (sender, uuid) -> [start time, parts, count, bytes] - oldest first
+		self.done      = OrderedDict()				# Recently completed (sender, uuid), to recognise late duplicates
+		self.bytes     = 0
+
+		self.fragments  = 0
+		self.messages   = 0
+		self.duplicates = 0
+		self.expired    = 0
+		self.evicted    = 0
+		self.invalid    = 0
+
+	############################################################################
+
+	def reassemble(self, packets):
+
+		# Passes other packets through, and yields each message once its last fragment arrives
+
+		for ecc_packet in packets:
+
+			if ecc_packet and ecc_packet.get_meth() == eccPacket.METH_fragment:
+
+				yield from self.put(ecc_packet)
+
+			else:
+
+				yield ecc_packet
+
+	############################################################################
+
+	def put(self, ecc_packet):
+
+		self.fragments += 1
+
+		self.expire()
+
+		data = ecc_packet.get_data()
+
+		(uuid, index, size, part) = (data['uuid'], data['indx'], data['size'], data['part'])
+
+		if not (isinstance(uuid, str) and isinstance(index, int) and isinstance(size, int) and isinstance(part, str)) or not 0 <= index < size <= self.fragment_limit:
+
+			self.invalid += 1
+
+			return [None]
+
+		key = (ecc_packet.get_from(), uuid)
+
+		if key in self.done:
+
+			self.duplicates += 1
+
+			return []
+
+		if key not in self.partial:
+
+			if len(self.partial) >= self.message_limit:
+
+				self.evict()
+
+			self.partial[key] = [self.clock(), [None] * size, 0, 0]
+
+		entry = self.partial[key]
+
+		if len(entry[1]) != size:
+
+			self.invalid += 1
+
+			return [None]
+
+		if entry[1][index] is not None:
+
+			self.duplicates += 1
+
+			return []
+
+		entry[1][index] = part
+		entry[2]       += 1
+		entry[3]       += len(part)
+
+		self.bytes += len(part)
+
+		while self.bytes > self.byte_limit and self.partial:
+
+			self.evict()
+
+		if key not in self.partial or entry[2] < size:
+
+			return []
+
+		self.remove(key)
+
+		self.done[key] = True
+
+		if len(self.done) > self.done_limit:
+
+			self.done.popitem(last = False)
+
+		self.messages += 1
+
+		try:
+
+			packets = eccPacket.from_message(''.join(entry[1])).unpack()
+
+		except (ValueError, KeyError, TypeError, RecursionError):
+
+			self.invalid += 1
+
+			return [None]
+
+		if any(packet.get_meth() == eccPacket.METH_fragment for packet in packets):
+
+			self.invalid += 1
+
+			return [None]
+
+		return packets
+
+	############################################################################
+
+	def remove(self, key):
+
+		entry = self.partial.pop(key)
+
+		self.bytes -= entry[3]
+
+	############################################################################
+
+	def evict(self):
+
+		self.remove(next(iter(self.partial)))
+
+		self.evicted += 1
+
+	############################################################################
+
+	def expire(self):
+
+		limit = self.clock() - self.timeout
+
+		while self.partial and next(iter(self.partial.values()))[0] < limit:
+
+			self.remove(next(iter(self.partial)))
+
+			self.expired += 1
+
+################################################################################
+## eccDedupCache class #########################################################
+################################################################################
+
+class eccDedupCache():
+
+	# Remembers the packets already handled, keyed by sender, method and uuid,
+	# so that a packet delivered twice is only acted on once. Entries expire
+	# after ttl seconds and the least recently seen is dropped beyond limit.
+	# The reply to a request can be remembered too, so that a retransmitted
+	# request gets the same answer again
+
+	methods = {eccPacket.METH_chatMsg,
+			   eccPacket.METH_addrReq,
+			   eccPacket.METH_addrRes,
+			   eccPacket.METH_txidInf,
+			   eccPacket.METH_swapInf,
+			   eccPacket.METH_swapReq,
+			   eccPacket.METH_swapRes}
+
+	############################################################################
+
+	def __init__(self, limit = 4096, ttl = 600, clock = time.monotonic):
+
+		self.limit = limit
+		self.ttl   = ttl
+		self.clock = clock
+
+		self.entries = OrderedDict()				# key -> time last seen, least recently seen first
+		self.replies = {}							# key -> (meth, data) sent in reply
+
+		self.lookups = 0
+		self.hits    = 0
+		self.expired = 0
+		self.evicted = 0
+
+	############################################################################
+
+	def key(self, ecc_packet):
+
+		if ecc_packet.get_meth() not in self.methods:
+
+			return None
+
+		data = ecc_packet.get_data()
+
+		# replace and delete carry the uuid of the message they change
+
+		if data.get('cmmd', 'add') != 'add':
+
+			return None
+
+		# Without a uuid one request cannot be told from the next
+
+		if not data['uuid']:
+
+			return None
+
+		return (ecc_packet.get_from(), ecc_packet.get_meth(), data['uuid'])
+
+	############################################################################
+
+	def seen(self, ecc_packet):
+
+		key = self.key(ecc_packet)
+
+		if key is None:
+
+			return False
+
+		self.lookups += 1
+
+		now = self.clock()
+
+		while self.entries and next(iter(self.entries.values())) < now - self.ttl:
+
+			self.forget()
+
+			self.expired += 1
+
+		hit = key in self.entries
+
+		self.entries[key] = now
+
+		self.entries.move_to_end(key)
+
+		if hit:
+
+			self.hits += 1
+
+		elif len(self.entries) > self.limit:
+
+			self.forget()
+
+			self.evicted += 1
+
+		return hit
+
+	############################################################################
+
+	def forget(self):
+
+		(key, when) = self.entries.popitem(last = False)
+
+		self.replies.pop(key, None)
+
+	############################################################################
+
+	def remember(self, ecc_packet, meth, data):
+
+		if (key := self.key(ecc_packet)) in self.entries:
+
+			self.replies[key] = (meth, data)
+
+	############################################################################
+
+	def reply(self, ecc_packet):
+
+		return self.replies.get(self.key(ecc_packet))
+
+################################################################################
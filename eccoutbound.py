@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import random
+import time
+
+from collections import OrderedDict, deque
+
+from eccpacket import eccPacket
+
+################################################################################
+## eccCoalescer class ##########################################################
+################################################################################
+
+class eccCoalescer():
+
+	# Messages for one destination are gathered over a short window and handed
+	# to transmit(dest, messages) together, so that they can travel as a single
+	# envelope packet. schedule(delay, callback) is supplied by the event loop
+
+	############################################################################
+
+	def __init__(self, transmit, schedule, window = 0.05, limit = 16):
+
+		self.transmit = transmit
+		self.schedule = schedule
+		self.window   = window
+		self.limit    = limit
+
+		self.pending  = {}							# dest -> list of queued items
+
+		self.messages = 0
+		self.packets  = 0
+
+	############################################################################
+
+	def put(self, dest, meth, data):
+
+		self.add(dest, (meth, data))
+
+	############################################################################
+
+	def add(self, dest, item):
+
+		self.messages += 1
+
+		if dest not in self.pending:
+
+			self.pending[dest] = []
+
+			self.schedule(self.window, lambda: self.flush(dest))
+
+		self.pending[dest].append(item)
+
+		if len(self.pending[dest]) >= self.limit:
+
+			self.flush(dest)
+
+	############################################################################
+
+	def flush(self, dest):
+
+		# Also called by the window timer after a full batch has gone - then there is nothing to do
+
+		messages = self.pending.pop(dest, None)
+
+		if messages:
+
+			self.packets += 1
+
+			self.transmit(dest, messages)
+
+	############################################################################
+
+	def flush_all(self):
+
+		for dest in list(self.pending):
+
+			self.flush(dest)
+
+################################################################################
+## eccAckCollector class #######################################################
+################################################################################
+
+class eccAckCollector(eccCoalescer):
+
+	# The uuids of received messages are acknowledged together after a short
+	# delay, unless take() hands them to a message already going to the sender
+
+	############################################################################
+
+	def __init__(self, transmit, schedule, window = 0.2, limit = 64):
+
+		super().__init__(transmit, schedule, window, limit)
+
+		self.piggybacked = 0
+
+	############################################################################
+
+	def put(self, dest, uuid):
+
+		self.add(dest, uuid)
+
+	############################################################################
+
+	def take(self, dest):
+
+		uuids = self.pending.pop(dest, [])
+
+		if uuids:
+
+			self.piggybacked += 1
+
+		return uuids
+
+################################################################################
+## eccScheduler class ##########################################################
+################################################################################
+
+class eccScheduler():
+
+	# Outbound packets wait here between being built and being sent. Control
+	# traffic goes before payment traffic, which goes before chat. Within a
+	# class each destination has its own queue, served in turn
+
+	PRIORITY_control = 0
+	PRIORITY_payment = 1
+	PRIORITY_chat    = 2
+
+	PRIORITY_NAMES = ('control', 'payment', 'chat')
+
+	priorities = {eccPacket.METH_helo     : PRIORITY_control,
+				  eccPacket.METH_ping     : PRIORITY_control,
+				  eccPacket.METH_pong     : PRIORITY_control,
+				  eccPacket.METH_chatAck  : PRIORITY_control,
+				  eccPacket.METH_chatAcks : PRIORITY_control,
+				  eccPacket.METH_addrReq  : PRIORITY_payment,
+				  eccPacket.METH_addrRes  : PRIORITY_payment,
+				  eccPacket.METH_txidInf  : PRIORITY_payment,
+				  eccPacket.METH_swapInf  : PRIORITY_payment,
+				  eccPacket.METH_swapReq  : PRIORITY_payment,
+				  eccPacket.METH_swapRes  : PRIORITY_payment,
+				  eccPacket.METH_chatMsg  : PRIORITY_chat}
+
+	############################################################################
+
+	def __init__(self):
+
+		self.queues = [OrderedDict() for _ in self.PRIORITY_NAMES]		# per class : dest -> deque, in turn order
+
+		self.count      = 0
+		self.depth      = [0] * len(self.PRIORITY_NAMES)				# Packets queued now, per class
+		self.max_depth  = [0] * len(self.PRIORITY_NAMES)				# High water mark, per class
+		self.max_dest   = 0												# Deepest any one destination has been
+		self.sent       = [0] * len(self.PRIORITY_NAMES)
+
+	############################################################################
+
+	def __len__(self):
+
+		return self.count
+
+	############################################################################
+
+	@classmethod
+
+	def priority(cls, meths):
+
+		# An envelope goes at the most urgent priority of the messages it carries
+
+		return min(cls.priorities.get(meth, cls.PRIORITY_chat) for meth in meths)
+
+	############################################################################
+
+	def put(self, dest, priority, item):
+
+		queues = self.queues[priority]
+
+		if dest not in queues:
+
+			queues[dest] = deque()
+
+		queues[dest].append(item)
+
+		self.count           += 1
+		self.depth[priority] += 1
+
+		self.max_depth[priority] = max(self.max_depth[priority], self.depth[priority])
+
+		self.max_dest = max(self.max_dest, sum(len(queues[dest]) for queues in self.queues if dest in queues))
+
+	############################################################################
+
+	def get(self, busy = ()):
+
+		# Returns (dest, priority, item) for the next packet to send, skipping busy destinations
+
+		for priority, queues in enumerate(self.queues):
+
+			for dest in queues:
+
+				if dest in busy:
+
+					continue
+
+				queue = queues[dest]
+
+				item = queue.popleft()
+
+				if queue:
+
+					queues.move_to_end(dest)
+
+				else:
+
+					del queues[dest]
+
+				self.count           -= 1
+				self.depth[priority] -= 1
+				self.sent[priority]  += 1
+
+				return (dest, priority, item)
+
+		return None
+
+	############################################################################
+
+	def ready(self, busy = ()):
+
+		return any(dest not in busy for queues in self.queues for dest in queues)
+
+	############################################################################
+
+	def requeue(self, dest, priority, item):
+
+		# A packet that failed to send goes back to the head of its queue, ahead of anything sent after it
+
+		queues = self.queues[priority]
+
+		if dest not in queues:
+
+			queues[dest] = deque()
+
+		queues[dest].appendleft(item)
+
+		self.count           += 1
+		self.depth[priority] += 1
+		self.sent[priority]  -= 1
+
+	############################################################################
+
+	def drop(self, dest):
+
+		# Removes everything queued for dest, returning the items
+
+		items = []
+
+		for priority, queues in enumerate(self.queues):
+
+			if dest in queues:
+
+				queue = queues.pop(dest)
+
+				items.extend(queue)
+
+				self.count           -= len(queue)
+				self.depth[priority] -= len(queue)
+
+		return items
+
+################################################################################
+## eccBackoff class ############################################################
+################################################################################
+
+class eccBackoff():
+
+	# Destinations whose last send failed are held back for a delay that
+	# doubles with each further failure, up to ceiling, with some jitter so
+	# that retries do not line up. After attempts failures in a row the
+	# destination is given up on
+
+	def __init__(self, base = 0.5, factor = 2.0, ceiling = 30.0, attempts = 6, jitter = 0.2, clock = time.monotonic, random = random.random):
+
+		self.base     = base
+		self.factor   = factor
+		self.ceiling  = ceiling
+		self.attempts = attempts
+		self.jitter   = jitter
+		self.clock    = clock
+		self.random   = random
+
+		self.held = {}								# dest -> [failures in a row, time of next attempt]
+
+		self.failures  = 0
+		self.recovered = 0
+		self.abandoned = 0
+
+	############################################################################
+
+	def failed(self, dest):
+
+		# Returns the delay before dest is tried again, or None when the attempts are used up
+
+		self.failures += 1
+
+		failures = self.held[dest][0] + 1 if dest in self.held else 1
+
+		if failures >= self.attempts:
+
+			del self.held[dest]
+
+			self.abandoned += 1
+
+			return None
+
+		delay = min(self.ceiling, self.base * self.factor ** (failures - 1)) * (1 + self.jitter * (2 * self.random() - 1))
+
+		self.held[dest] = [failures, self.clock() + delay]
+
+		return delay
+
+	############################################################################
+
+	def succeeded(self, dest):
+
+		# Returns True if dest had been failing
+
+		if self.held.pop(dest, None):
+
+			self.recovered += 1
+
+			return True
+
+		return False
+
+	############################################################################
+
+	@staticmethod
+
+	def route_lost(error):
+
+		# Both the daemon and setup_route say so in the message when there is no route to the destination
+
+		return 'route' in str(error).lower()
+
+	############################################################################
+
+	def blocked(self):
+
+		now = self.clock()
+
+		return {dest for dest, (failures, resume) in self.held.items() if resume > now}
+
+	############################################################################
+
+	def next_due(self):
+
+		# Seconds until the next held destination may be tried again, None if none is waiting
+
+		now = self.clock()
+
+		waiting = [resume - now for (failures, resume) in self.held.values() if resume > now]
+
+		return min(waiting) if waiting else None
+
+################################################################################
+## eccTokenBucket class ########################################################
+################################################################################
+
+class eccTokenBucket():
+
+	# Holds up to burst tokens, refilled at rate per second - each send takes one
+
+	def __init__(self, rate, burst, now):
+
+		self.rate   = rate
+		self.burst  = burst
+		self.tokens = burst
+		self.stamp  = now
+
+	############################################################################
+
+	def refill(self, now):
+
+		self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp  = now
+
+		# Allow for rounding, or a wake up timed for the next token could find it not quite there
+
+		return self.tokens > 1 - 1e-9
+
+	############################################################################
+
+	def take(self, now):
+
+		# Returns True when this takes the last whole token
+
+		self.refill(now)
+
+		self.tokens -= 1
+
+		return self.tokens <= 1 - 1e-9
+
+	############################################################################
+
+	def wait(self, now):
+
+		# Seconds until a token is available
+
+		self.refill(now)
+
+		return max(0.0, (1 - self.tokens) / self.rate)
+
+################################################################################
+## eccShaper class #############################################################
+################################################################################
+
+class eccShaper():
+
+	# Paces outbound packets with a token bucket per destination and one for
+	# all of them, so a burst of sends is spread out instead of swamping the
+	# local node. Packets are held in the scheduler rather than dropped
+
+	def __init__(self, rate = 20.0, burst = 40, total_rate = 50.0, total_burst = 100, limit = 4096, clock = time.monotonic):
+
+		self.rate  = rate
+		self.burst = burst
+		self.limit = limit
+		self.clock = clock
+
+		self.total   = eccTokenBucket(total_rate, total_burst, clock())
+		self.buckets = OrderedDict()				# dest -> eccTokenBucket, least recently used first
+
+		self.throttled       = 0					# Times a destination ran out of tokens
+		self.throttled_total = 0					# Times the overall bucket ran out
+
+	############################################################################
+
+	def ready(self):
+
+		return self.total.refill(self.clock())
+
+	############################################################################
+
+	def blocked(self):
+
+		now = self.clock()
+
+		return {dest for dest, bucket in self.buckets.items() if not bucket.refill(now)}
+
+	############################################################################
+
+	def take(self, dest):
+
+		now = self.clock()
+
+		if dest in self.buckets:
+
+			self.buckets.move_to_end(dest)
+
+		else:
+
+			self.buckets[dest] = eccTokenBucket(self.rate, self.burst, now)
+
+			if len(self.buckets) > self.limit:
+
+				self.buckets.popitem(last = False)
+
+		if self.buckets[dest].take(now):
+
+			self.throttled += 1
+
+		if self.total.take(now):
+
+			self.throttled_total += 1
+
+	############################################################################
+
+	def next_due(self):
+
+		# Seconds until a send held back here may go, None if nothing is held back
+
+		now = self.clock()
+
+		if not self.total.refill(now):
+
+			return self.total.wait(now)
+
+		waiting = [bucket.wait(now) for bucket in self.buckets.values() if not bucket.refill(now)]
+
+		return min(waiting) if waiting else None
+
+################################################################################
@@ -1,7 +1,370 @@
 #!/usr/bin/env python3
 # coding: UTF-8
 
+import binascii
+import base64
+import struct
 import json
+import enum
+import zlib
+
+from collections import namedtuple
+from operator    import itemgetter
+from uuid        import UUID, uuid4
+
+################################################################################
+## eccCompact class ############################################################
+################################################################################
+
+class eccCompact():
+
+	# Compact binary encoding of packet fields. Each value is written with a one
+	# byte type code so that uuids, routing tags and numbers round trip exactly
+
+	MAGIC      = 0xEC
+	MAGIC_zlib = 0xED						# Frame after the magic byte is zlib compressed
+
+	INFLATE_limit = 0x10000					# Largest decompressed frame accepted
+	DEPTH_limit   = 32						# Deepest nesting of lists and dicts accepted
+
+	TYPE_str   = 0
+	TYPE_uuid  = 1
+	TYPE_b64   = 2
+	TYPE_true  = 3
+	TYPE_false = 4
+	TYPE_int   = 5
+	TYPE_float = 6
+	TYPE_null  = 7
+	TYPE_json  = 8
+	TYPE_list  = 9
+	TYPE_dict  = 10
+
+	############################################################################
+
+	@staticmethod
+
+	def put_varint(buffer, value):
+
+		while value > 0x7F:
+
+			buffer.append((value & 0x7F) | 0x80)
+
+			value >>= 7
+
+		buffer.append(value)
+
+	############################################################################
+
+	@staticmethod
+
+	def get_varint(frame, offset):
+
+		value = frame[offset]
+
+		if value < 0x80:
+
+			return (value, offset + 1)			# Lengths and small ids fit in one byte
+
+		value = 0
+		shift = 0
+
+		while True:
+
+			byte = frame[offset]
+
+			offset += 1
+
+			value |= (byte & 0x7F) << shift
+
+			if byte < 0x80:
+
+				return (value, offset)
+
+			shift += 7
+
+	############################################################################
+
+	@classmethod
+
+	def put_bytes(cls, buffer, data):
+
+		cls.put_varint(buffer, len(data))
+
+		buffer += data
+
+	############################################################################
+
+	@classmethod
+
+	def get_bytes(cls, frame, offset):
+
+		(length, offset) = cls.get_varint(frame, offset)
+
+		end = offset + length
+
+		return (frame[offset:end], end)
+
+	############################################################################
+
+	@classmethod
+
+	def put_value(cls, buffer, value):
+
+		if value is True:
+
+			buffer.append(cls.TYPE_true)
+
+		elif value is False:
+
+			buffer.append(cls.TYPE_false)
+
+		elif value is None:
+
+			buffer.append(cls.TYPE_null)
+
+		elif isinstance(value, int):
+
+			buffer.append(cls.TYPE_int)
+
+			cls.put_varint(buffer, (value << 1) ^ -(value < 0))		# zigzag, for ints of any size
+
+		elif isinstance(value, float):
+
+			buffer.append(cls.TYPE_float)
+
+			buffer += struct.pack('<d', value)
+
+		elif isinstance(value, str):
+
+			if len(value) == 36 and cls.is_uuid(value):
+
+				buffer.append(cls.TYPE_uuid)
+
+				buffer += UUID(value).bytes
+
+			elif (raw := cls.from_b64(value)) is not None:
+
+				buffer.append(cls.TYPE_b64)
+
+				cls.put_bytes(buffer, raw)
+
+			else:
+
+				buffer.append(cls.TYPE_str)
+
+				cls.put_bytes(buffer, value.encode())
+
+		elif isinstance(value, list):
+
+			buffer.append(cls.TYPE_list)
+
+			cls.put_varint(buffer, len(value))
+
+			for item in value:
+
+				cls.put_value(buffer, item)
+
+		elif isinstance(value, dict) and all(isinstance(key, str) for key in value):
+
+			buffer.append(cls.TYPE_dict)
+
+			cls.put_varint(buffer, len(value))
+
+			for key, item in value.items():
+
+				cls.put_bytes(buffer, key.encode())
+				cls.put_value(buffer, item)
+
+		else:
+
+			buffer.append(cls.TYPE_json)
+
+			cls.put_bytes(buffer, json.dumps(value).encode())
+
+	############################################################################
+
+	@classmethod
+
+	def get_value(cls, frame, offset, depth = 0):
+
+		code = frame[offset]
+
+		offset += 1
+
+		if code == cls.TYPE_str:
+
+			(data, offset) = cls.get_bytes(frame, offset)
+
+			return (data.decode(), offset)
+
+		if code == cls.TYPE_uuid:
+
+			h = frame[offset:offset + 16].hex()
+
+			return ('{}-{}-{}-{}-{}'.format(h[0:8], h[8:12], h[12:16], h[16:20], h[20:32]), offset + 16)
+
+		if code == cls.TYPE_b64:
+
+			(data, offset) = cls.get_bytes(frame, offset)
+
+			return (binascii.b2a_base64(data, newline = False).decode(), offset)
+
+		if code == cls.TYPE_true:
+
+			return (True, offset)
+
+		if code == cls.TYPE_false:
+
+			return (False, offset)
+
+		if code == cls.TYPE_int:
+
+			(value, offset) = cls.get_varint(frame, offset)
+
+			return ((value >> 1) ^ -(value & 1), offset)
+
+		if code == cls.TYPE_float:
+
+			return (struct.unpack_from('<d', frame, offset)[0], offset + 8)
+
+		if code == cls.TYPE_null:
+
+			return (None, offset)
+
+		if code in (cls.TYPE_list, cls.TYPE_dict) and depth >= cls.DEPTH_limit:
+
+			raise ValueError('Compact value nested too deeply')
+
+		if code == cls.TYPE_list:
+
+			(count, offset) = cls.get_varint(frame, offset)
+
+			value = []
+
+			for _ in range(count):
+
+				(item, offset) = cls.get_value(frame, offset, depth + 1)
+
+				value.append(item)
+
+			return (value, offset)
+
+		if code == cls.TYPE_dict:
+
+			(count, offset) = cls.get_varint(frame, offset)
+
+			value = {}
+
+			for _ in range(count):
+
+				(key, offset) = cls.get_bytes(frame, offset)
+
+				(value[key.decode()], offset) = cls.get_value(frame, offset, depth + 1)
+
+			return (value, offset)
+
+		if code == cls.TYPE_json:
+
+			(data, offset) = cls.get_bytes(frame, offset)
+
+			try:
+
+				return (json.loads(data), offset)
+
+			except RecursionError:
+
+				raise ValueError('Compact json value nested too deeply')
+
+		raise ValueError('Unknown compact value type : {}'.format(code))
+
+	############################################################################
+
+	@staticmethod
+
+	def is_uuid(value):
+
+		try:
+
+			return str(UUID(value)) == value
+
+		except ValueError:
+
+			return False
+
+	############################################################################
+
+	@staticmethod
+
+	def from_b64(value):
+
+		# Only strings that survive a base64 round trip unchanged are stored as raw bytes
+
+		if len(value) < 8 or len(value) % 4:
+
+			return None
+
+		try:
+
+			raw = base64.b64decode(value, validate = True)
+
+		except ValueError:
+
+			# binascii.Error, or a string that is not ascii
+
+			return None
+
+		if base64.b64encode(raw).decode() != value:
+
+			return None
+
+		return raw
+
+################################################################################
+
+def field_getter(keys):
+
+	# itemgetter returns a bare value rather than a tuple when given a single key
+
+	if len(keys) == 1:
+
+		return lambda data, key = keys[0]: (data[key],)
+
+	return itemgetter(*keys)
+
+################################################################################
+## eccMeth class ###############################################################
+################################################################################
+
+class eccMeth(str, enum.Enum):
+
+	# One interned member per method - compares and hashes equal to the plain string
+
+	chatMsg  = 'chatMsg'
+	chatAck  = 'chatAck'
+	addrReq  = 'addrReq'
+	addrRes  = 'addrRes'
+	txidInf  = 'txidInf'
+	swapInf  = 'swapInf'
+	swapReq  = 'swapReq'
+	swapRes  = 'swapRes'
+	envelope = 'envelope'
+	chatAcks = 'chatAcks'
+	fragment = 'fragment'
+	helo     = 'helo'
+	ping     = 'ping'
+	pong     = 'pong'
+
+	############################################################################
+
+	def __str__(self):
+
+		return self.value
+
+	############################################################################
+
+	def __format__(self, format_spec):
+
+		return self.value.__format__(format_spec)
 
 ################################################################################
 ## eccPacket class #############################################################
@@ -9,23 +372,50 @@ import json
 
 class eccPacket():
 
-	METH_chatMsg = 'chatMsg'
-	METH_chatAck = 'chatAck'
-	METH_addrReq = 'addrReq'
-	METH_addrRes = 'addrRes'
-	METH_txidInf = 'txidInf'
-	METH_swapInf = 'swapInf'
-	METH_swapReq = 'swapReq'
-	METH_swapRes = 'swapRes'
-
-	METH_SET = [METH_chatMsg,
-				METH_chatAck,
-				METH_addrReq,
-				METH_addrRes,
-				METH_txidInf,
-				METH_swapInf,
-				METH_swapReq,
-				METH_swapRes]
+	__slots__ = ('id', 'ver', 'to', 'src', 'meth', 'data')
+
+	METH_chatMsg  = eccMeth.chatMsg
+	METH_chatAck  = eccMeth.chatAck
+	METH_addrReq  = eccMeth.addrReq
+	METH_addrRes  = eccMeth.addrRes
+	METH_txidInf  = eccMeth.txidInf
+	METH_swapInf  = eccMeth.swapInf
+	METH_swapReq  = eccMeth.swapReq
+	METH_swapRes  = eccMeth.swapRes
+	METH_envelope = eccMeth.envelope
+	METH_chatAcks = eccMeth.chatAcks
+	METH_fragment = eccMeth.fragment
+	METH_helo     = eccMeth.helo
+	METH_ping     = eccMeth.ping
+	METH_pong     = eccMeth.pong
+
+	# Capabilities advertised by helo - the other party only uses those it has been sent
+
+	CAP_compact  = 'compact'					# Accepts the compact binary encoding
+	CAP_zlib     = 'zlib'						# Accepts compressed compact frames
+	CAP_envelope = 'envelope'					# Accepts envelopes of several messages
+	CAP_acks     = 'acks'						# Accepts cumulative chatAcks
+	CAP_fragment = 'fragment'					# Reassembles fragments of large messages
+	CAP_delta    = 'delta'						# Applies chatMsg edits sent as a diff, and uuid only deletes
+
+	CAPS = frozenset({CAP_compact, CAP_zlib, CAP_envelope, CAP_acks, CAP_fragment, CAP_delta})
+
+	# Parties before protocol version 2 fail on any method they do not know, helo included, so a
+	# party is only sent helo once a packet of version 2 or later has arrived from it
+
+	VER_helo = 2
+
+	ZLIB_threshold = 160					# Smallest frame worth compressing (bytes)
+
+	FRAG_size = 2048						# Largest message sent whole, and the fragment size
+
+	METH_SET = tuple(eccMeth)				# Position is the method code on the compact wire
+
+	METH_CODE = {meth : code for code, meth in enumerate(METH_SET)}
+
+	METH_NAME = {meth.value : meth for meth in METH_SET}	# Method name as received -> member, without calling eccMeth
+
+	JSON = json.JSONDecoder()
 
 	KEY_LIST = {METH_chatMsg : ('uuid', 'cmmd', 'text'),
 				METH_chatAck : ('uuid', 'cmmd', 'able'),
@@ -34,24 +424,66 @@ class eccPacket():
 				METH_txidInf : ('uuid', 'coin', 'amnt', 'addr', 'txid'),
 				METH_swapInf : ('uuid', 'cogv', 'amgv', 'cotk', 'amtk'),
 				METH_swapReq : ('uuid', 'cogv', 'adgv'),
-				METH_swapRes : ('uuid', 'cotk', 'adtk')}
+				METH_swapRes : ('uuid', 'cotk', 'adtk'),
+				METH_envelope : ('msgs',),
+				METH_chatAcks : ('uids', 'able'),
+				METH_fragment : ('uuid', 'indx', 'size', 'part'),
+				METH_helo     : ('caps', 'resp'),
+				METH_ping     : ('uuid', 'seqn'),
+				METH_pong     : ('uuid', 'seqn')}
+
+	# Precompiled per method : the validator fetches every required field in one call
+
+	VALIDATORS = {meth : field_getter(keys) for meth, keys in KEY_LIST.items()}
+
+	FIELDS = {meth : namedtuple(meth + 'Data', keys) for meth, keys in KEY_LIST.items()}
 
 	############################################################################
 
 	def __init__(self, _id = '', _ver = '', _to = '', _from = '', _meth = '', _data = ''):
 
-		assert isinstance(_data, dict)
+		self.meth = eccMeth(_meth)
+
+		self.validate(self.meth, _data)
+
+		self.id   = _id
+		self.ver  = _ver
+		self.to   = _to
+		self.src  = _from
+		self.data = _data
 
-		assert _meth in self.METH_SET
+	############################################################################
+
+	@classmethod
 
-		assert all(key in _data for key in self.KEY_LIST[_meth])
+	def validate(cls, meth, data):
 
-		self.packet = {	'id'	: _id,
-						'ver'	: _ver,
-						'to'	: _to,
-						'from'	: _from,
-						'meth'	: _meth,
-						'data'	: _data}
+		try:
+
+			return cls.VALIDATORS[meth](data)
+
+		except (KeyError, TypeError):
+
+			raise ValueError('Malformed ecchat {} packet'.format(meth))
+
+	############################################################################
+
+	@classmethod
+
+	def adopt(cls, _id, _ver, _to, _from, _meth, _data):
+
+		# Builds a packet whose fields are already known to be valid
+
+		ecc_packet = cls.__new__(cls)
+
+		ecc_packet.id   = _id
+		ecc_packet.ver  = _ver
+		ecc_packet.to   = _to
+		ecc_packet.src  = _from
+		ecc_packet.meth = _meth
+		ecc_packet.data = _data
+
+		return ecc_packet
 
 	############################################################################
 
@@ -59,9 +491,215 @@ class eccPacket():
 
 	def from_json(cls, json_string = ''):
 
-		d = json.loads(json_string)
+		return cls.from_dict(json.loads(json_string))
+
+	############################################################################
+
+	@classmethod
+
+	def from_dict(cls, d):
+
+		if (meth := cls.METH_NAME.get(d['meth'])) is None:
+
+			raise ValueError('Unknown ecchat method : {}'.format(d['meth']))
+
+		cls.validate(meth, d['data'])
+
+		return cls.adopt(d['id'], d['ver'], d['to'], d['from'], meth, d['data'])
+
+	############################################################################
+
+	@classmethod
+
+	def from_hex(cls, hex_string):
+
+		raw = bytes.fromhex(hex_string)
+
+		if raw[:1] == b'{':
+
+			# raw_decode skips the wrappers of json.loads, as the text is known to start with the object
+
+			text = raw.decode()
+
+			(d, end) = cls.JSON.raw_decode(text)
+
+			if text[end:].strip():
+
+				raise ValueError('Extra data after ecchat packet')
+
+			return cls.from_dict(d)
+
+		return cls.from_binary(base64.b64decode(raw))
+
+	############################################################################
+
+	@classmethod
+
+	def decode_buffer(cls, eccbuffer):
+
+		# Yields a packet for each hex entry returned by getbuffer, or None where it is invalid
+
+		for hex_string in eccbuffer.values():
+
+			try:
+
+				ecc_packet = cls.from_hex(hex_string)
+
+				# Only envelopes need unpacking - anything else is yielded as it is
+
+				if ecc_packet.meth == cls.METH_envelope:
+
+					yield from ecc_packet.unpack()
+
+				else:
+
+					yield ecc_packet
+
+			except (ValueError, KeyError, TypeError, RecursionError):
+
+				# RecursionError from json.loads on deeply nested input
+
+				yield None
+
+	############################################################################
+
+	@classmethod
+
+	def from_binary(cls, frame):
+
+		if frame[:1] == bytes([eccCompact.MAGIC_zlib]):
+
+			frame = bytes([eccCompact.MAGIC]) + cls.inflate(frame[1:])
+
+		if not frame or frame[0] != eccCompact.MAGIC:
+
+			raise ValueError('Not a compact ecchat packet')
+
+		try:
+
+			(_ver,  offset) = eccCompact.get_varint(frame, 1)
+			(_id,   offset) = eccCompact.get_varint(frame, offset)
+			(_to,   offset) = eccCompact.get_value(frame, offset)
+			(_from, offset) = eccCompact.get_value(frame, offset)
+
+			_meth = cls.METH_SET[frame[offset]]
+
+			offset += 1
+
+			_data = {}
+
+			for key in cls.KEY_LIST[_meth]:
+
+				(_data[key], offset) = eccCompact.get_value(frame, offset)
+
+			(extra, offset) = eccCompact.get_varint(frame, offset)
+
+			for _ in range(extra):
+
+				(key, offset) = eccCompact.get_bytes(frame, offset)
+
+				(_data[key.decode()], offset) = eccCompact.get_value(frame, offset)
+
+		except (IndexError, struct.error):
+
+			raise ValueError('Truncated compact ecchat packet')
+
+		# Every required data field is present by construction of the frame
+
+		return cls.adopt(_id, _ver, _to, _from, _meth, _data)
+
+	############################################################################
+
+	@staticmethod
+
+	def inflate(data):
+
+		# Bounded, so that a small packet cannot expand without limit
+
+		decompressor = zlib.decompressobj()
+
+		try:
+
+			frame = decompressor.decompress(data, eccCompact.INFLATE_limit)
+
+		except zlib.error as error:
+
+			raise ValueError('Corrupt compressed ecchat packet : {}'.format(error))
+
+		if decompressor.unconsumed_tail or not decompressor.eof:
+
+			raise ValueError('Compressed ecchat packet too large or truncated')
+
+		return frame
+
+	############################################################################
+
+	@classmethod
+
+	def from_compact(cls, compact_string = ''):
+
+		return cls.from_binary(base64.b64decode(compact_string))
+
+	############################################################################
+
+	@classmethod
+
+	def from_message(cls, message = ''):
+
+		# JSON packets always start with '{' which never starts a compact packet
+
+		if message.startswith('{'):
+
+			return cls.from_json(message)
+
+		return cls.from_compact(message)
+
+	############################################################################
+
+	@classmethod
+
+	def envelope(cls, _id, _ver, _to, _from, messages):
+
+		msgs = [{'meth' : meth, 'data' : data} for (meth, data) in messages]
+
+		return cls(_id, _ver, _to, _from, cls.METH_envelope, {'msgs' : msgs})
+
+	############################################################################
+
+	def unpack(self):
+
+		# The messages carried by an envelope, each as a packet of its own
+
+		if self.meth != self.METH_envelope:
+
+			return [self]
+
+		msgs = self.data['msgs']
+
+		if not isinstance(msgs, list):
+
+			raise ValueError('Malformed ecchat envelope')
+
+		packets = [eccPacket(self.id, self.ver, self.to, self.src, msg['meth'], msg['data']) for msg in msgs]
+
+		if any(packet.meth == self.METH_envelope for packet in packets):
+
+			raise ValueError('Nested ecchat envelope')
+
+		return packets
 
-		return cls(d['id'], d['ver'], d['to'], d['from'], d['meth'], d['data'])
+	############################################################################
+
+	@property
+
+	def packet(self):
+
+		return {'id'	: self.id,
+				'ver'	: self.ver,
+				'to'	: self.to,
+				'from'	: self.src,
+				'meth'	: self.meth,
+				'data'	: self.data}
 
 	############################################################################
 
@@ -71,52 +709,180 @@ class eccPacket():
 
 	############################################################################
 
+	def to_binary(self):
+
+		frame = bytearray([eccCompact.MAGIC])
+
+		eccCompact.put_varint(frame, int(self.ver))
+		eccCompact.put_varint(frame, int(self.id))
+		eccCompact.put_value (frame, self.to)
+		eccCompact.put_value (frame, self.src)
+
+		frame.append(self.METH_CODE[self.meth])
+
+		keys = self.KEY_LIST[self.meth]
+
+		for value in self.VALIDATORS[self.meth](self.data):
+
+			eccCompact.put_value(frame, value)
+
+		extra = [key for key in self.data if key not in keys]
+
+		eccCompact.put_varint(frame, len(extra))
+
+		for key in extra:
+
+			eccCompact.put_bytes(frame, key.encode())
+			eccCompact.put_value(frame, self.data[key])
+
+		return bytes(frame)
+
+	############################################################################
+
+	def to_compact(self):
+
+		# sendpacket carries text, so the binary frame travels base64 encoded
+
+		return base64.b64encode(self.to_binary()).decode()
+
+	############################################################################
+
+	def to_compressed(self):
+
+		# Only large frames are compressed, and only when that makes them smaller
+
+		frame = self.to_binary()
+
+		if len(frame) >= self.ZLIB_threshold:
+
+			packed = bytes([eccCompact.MAGIC_zlib]) + zlib.compress(frame[1:])
+
+			if len(packed) < len(frame):
+
+				frame = packed
+
+		return base64.b64encode(frame).decode()
+
+	############################################################################
+
+	def to_messages(self, caps = frozenset()):
+
+		# Messages too large for one packet are split for peers that can reassemble them
+
+		message = self.to_message(caps)
+
+		if self.CAP_fragment not in caps or len(message) <= self.FRAG_size:
+
+			return [message]
+
+		uuid = str(uuid4())
+
+		# Each fragment must fit in FRAG_size with its header, and escaping or encoding can grow the part as well.
+		# Parts start at FRAG_size less the size of an empty fragment, and shrink in proportion until all fit
+
+		header = len(self.to_fragments('', 1, uuid, caps)[0])
+
+		size = self.FRAG_size - header
+
+		while True:
+
+			fragments = self.to_fragments(message, size, uuid, caps)
+
+			longest = max(len(fragment) for fragment in fragments)
+
+			if longest <= self.FRAG_size:
+
+				return fragments
+
+			size = max(1, min(size - 1, size * (self.FRAG_size - header) // (longest - header)))
+
+	############################################################################
+
+	def to_fragments(self, message, size, uuid, caps):
+
+		parts = [message[index:index + size] for index in range(0, len(message), size)] or ['']
+
+		return [eccPacket(self.id, self.ver, self.to, self.src, self.METH_fragment, {'uuid' : uuid, 'indx' : index, 'size' : len(parts), 'part' : part}).to_message(caps)
+				for index, part in enumerate(parts)]
+
+	############################################################################
+
+	def to_message(self, caps = frozenset()):
+
+		if self.CAP_zlib in caps:
+
+			return self.to_compressed()
+
+		if self.CAP_compact in caps:
+
+			return self.to_compact()
+
+		return self.to_json()
+
+	############################################################################
+
 	def get_id(self):
 
-		return self.packet['id']
+		return self.id
 
 	############################################################################
 
 	def get_ver(self):
 
-		return self.packet['ver']
+		return self.ver
+
+	############################################################################
+
+	def knows_helo(self):
+
+		return isinstance(self.ver, int) and not isinstance(self.ver, bool) and self.ver >= self.VER_helo
 
 	############################################################################
 
 	def get_to(self):
 
-		return self.packet['to']
+		return self.to
 
 	############################################################################
 
 	def get_from(self):
 
-		return self.packet['from']
+		return self.src
 
 	############################################################################
 
 	def get_meth(self):
 
-		return self.packet['meth']
+		return self.meth
 
 	############################################################################
 
 	def get_data(self):
 
-		data = self.packet['data']
+		# Validated when the packet was built or decoded
+
+		return self.data
 
-		assert isinstance(data, dict)
+	############################################################################
+
+	def get_uuid(self):
+
+		return self.data['uuid']
 
-		assert self.packet['meth'] in self.METH_SET
+	############################################################################
+
+	def get_fields(self):
 
-		assert all(key in data for key in self.KEY_LIST[self.packet['meth']])
+		# Typed view of the required data fields, e.g. get_fields().text for a chatMsg
 
-		return data
+		return self.FIELDS[self.meth]._make(self.VALIDATORS[self.meth](self.data))
 
 	############################################################################
 
-	def send(self, proxy):
+	def send(self, proxy, caps = frozenset(), message = None):
+
+		# The encoding is chosen from the capabilities the destination has advertised
 
-		proxy.sendpacket(self.packet['to'], self.packet['id'], json.dumps(self.packet))
+		return proxy.sendpacket(self.to, self.id, message or self.to_message(caps))
 
 ################################################################################
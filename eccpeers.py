@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import time
+
+from collections import OrderedDict
+
+from eccpacket import eccPacket
+
+################################################################################
+## eccPeerTable class ##########################################################
+################################################################################
+
+class eccPeerTable():
+
+	# Capabilities learned from each peer's helo, keyed by routing tag. A peer
+	# that has been sent a helo but not answered is held as None, and has no
+	# capabilities. It is greeted again if a packet arrives from it once the
+	# helo timeout has passed, in case the helo or its answer was lost
+
+	############################################################################
+
+	def __init__(self, limit = 4096, helo_timeout = 10, clock = time.monotonic):
+
+		self.limit        = limit
+		self.helo_timeout = helo_timeout
+		self.clock        = clock
+
+		self.peers   = OrderedDict()				# routing tag -> frozenset of capabilities or None, least recent first
+		self.greeted = {}							# routing tag -> time of the helo not yet answered
+
+		self.helos = 0
+
+	############################################################################
+
+	def get(self, tag):
+
+		return self.peers.get(tag) or frozenset()
+
+	############################################################################
+
+	def heard(self, tag):
+
+		# True once the peer has sent a helo, even one advertising nothing
+
+		return self.peers.get(tag) is not None
+
+	############################################################################
+
+	def needs_helo(self, tag):
+
+		if self.peers.get(tag) is not None:
+
+			return False
+
+		if tag in self.greeted and self.clock() - self.greeted[tag] < self.helo_timeout:
+
+			return False
+
+		self.store(tag, None)
+
+		self.greeted[tag] = self.clock()
+
+		return True
+
+	############################################################################
+
+	def update(self, tag, caps):
+
+		self.helos += 1
+
+		self.greeted.pop(tag, None)
+
+		# Anything other than a list of names advertises nothing
+
+		if not isinstance(caps, list):
+
+			caps = []
+
+		self.store(tag, eccPacket.CAPS.intersection(cap for cap in caps if isinstance(cap, str)))
+
+	############################################################################
+
+	def store(self, tag, caps):
+
+		self.peers[tag] = caps
+
+		self.peers.move_to_end(tag)
+
+		if len(self.peers) > self.limit:
+
+			(tag, caps) = self.peers.popitem(last = False)
+
+			self.greeted.pop(tag, None)
+
+################################################################################
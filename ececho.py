@@ -1,39 +1,34 @@
 #!/usr/bin/env python3
 # coding: UTF-8
 
-import threading
 import datetime
 import argparse
+import asyncio
 import pathlib
 import logging
 import signal
-import codecs
 import cowsay
 import zmq
+import zmq.asyncio
 import sys
 
-from uuid import uuid4
+from functools import partial
+from uuid      import uuid4
 
 # Configuration file management : eccoin.conf
 
 from configure import loadConfigurationECC
 
-# eccPacket & cryptoNode  classes
+# eccPacket & asyncCryptoNode classes
 
 from eccpacket    import eccPacket
-from cryptonode   import cryptoNode, eccoinNode, cryptoNodeException
+from eccinbound   import eccInboundQueue, eccReassembler, eccDedupCache
+from eccoutbound  import eccCoalescer, eccAckCollector, eccScheduler, eccBackoff, eccShaper
+from eccpeers     import eccPeerTable
+from cryptonode   import cryptoNodeException
+from asyncnode    import asyncEccoinNode
 
-################################################################################
-## RepeatTimer class ###########################################################
-################################################################################
-
-class RepeatTimer(threading.Timer):
-
-    def run(self):
-
-        while not self.finished.wait(self.interval):
-
-            self.function(*self.args, **self.kwargs)
+from slickrpc import exc
 
 ################################################################################
 ## EchoApp class ###############################################################
@@ -41,62 +36,238 @@ class RepeatTimer(threading.Timer):
 
 class EchoApp:
 
-	def __init__(self, protocol, name, prefix, debug=False):
+	def __init__(self, protocol, name, prefix, timeout=10, jobs=64, debug=False, rate=20.0, burst=40, total_rate=50.0, total_burst=100):
 
 
 		self.protocol_id	= protocol
-		self.protocol_ver	= 1
+		self.protocol_ver	= 2						# 2 and later understand helo
+		self.caps			= eccPacket.CAPS - {eccPacket.CAP_delta}	# No message history to apply edits to
 		self.name			= name
 		self.prefix			= prefix
+		self.timeout		= timeout
+		self.jobs			= jobs
 		self.debug			= debug
 		self.subscribers	= []
 		self.coins			= []
 		self.running		= True
-		self.timer          = 0
+		self.inbound		= eccInboundQueue()
+		self.reassembly		= eccReassembler()
+		self.dedup			= eccDedupCache()
+		self.drainer		= None			# Task feeding queued packets to dispatch_ecc_packet
+		self.tasks			= set()			# Packet handling tasks in flight
+		self.peer_locks		= {}			# Serialises handling per peer, keyed by routing tag
+		self.peer_count		= {}			# Tasks queued or running per peer
+		self.peers			= eccPeerTable()	# Capabilities advertised by each peer
+		self.scheduler		= eccScheduler()
+		self.sending		= set()			# Destinations with a send in flight
+		self.backoff		= eccBackoff()
+		self.shaper			= eccShaper(rate, burst, total_rate, total_burst)
+		self.pings			= 0
+		self.senders		= 4				# Worker tasks, so a slow destination does not hold up the others
 
 	############################################################################
 
 	def send_ecc_packet(self, dest, meth, data):
 
-		ecc_packet = eccPacket(self.protocol_id, self.protocol_ver, dest, self.coins[0].routingTag, meth, data)
+		# Messages are batched into envelopes for peers that accept them
+
+		caps = self.peers.get(dest)
+
+		if eccPacket.CAP_envelope in caps:
+
+			# Acknowledgements waiting for this peer travel with the message
+
+			if eccPacket.CAP_acks in caps and (uuids := self.acks.take(dest)):
+
+				self.send_acks(dest, uuids)
+
+			self.outbound.put(dest, meth, data)
+
+		else:
+
+			self.transmit(dest, [(meth, data)])
+
+	############################################################################
+
+	def send_acks(self, dest, uuids):
+
+		self.outbound.put(dest, eccPacket.METH_chatAcks, {'uids' : uuids, 'able' : True})
+
+	############################################################################
+
+	def transmit(self, dest, messages):
+
+		if len(messages) == 1:
+
+			ecc_packet = eccPacket(self.protocol_id, self.protocol_ver, dest, self.coins[0].routingTag, *messages[0])
+
+		else:
+
+			ecc_packet = eccPacket.envelope(self.protocol_id, self.protocol_ver, dest, self.coins[0].routingTag, messages)
 
 		if self.debug:
 
 			logging.info('TX: {}'.format(ecc_packet.to_json()))
 
-		ecc_packet.send(self.coins[0])
+		priority = eccScheduler.priority(meth for (meth, data) in messages)
+
+		for message in ecc_packet.to_messages(self.peers.get(dest)):
+
+			self.scheduler.put(dest, priority, (ecc_packet, message))
+
+		self.send_wakeup.set()
+
+	############################################################################
+
+	async def send_worker(self):
+
+		# Sends queued packets in priority order, one at a time per destination so each stays in order
+
+		while True:
+
+			if not self.shaper.ready() or not (item := self.scheduler.get(self.sending | self.backoff.blocked() | self.shaper.blocked())):
+
+				self.send_wakeup.clear()
+
+				# Wake up in time to retry a destination that is backing off, or when the rate limit allows
+
+				delays = [delay for delay in (self.backoff.next_due(), self.shaper.next_due()) if delay is not None]
+
+				try:
+
+					await asyncio.wait_for(self.send_wakeup.wait(), min(delays) if delays else None)
+
+				except asyncio.TimeoutError:
+
+					pass
+
+				continue
+
+			self.shaper.take(item[0])
+
+			(dest, priority, (ecc_packet, message)) = item
+
+			self.sending.add(dest)
+
+			try:
+
+				await asyncio.wait_for(ecc_packet.send(self.coins[0], self.peers.get(dest), message), self.timeout)
+
+			except (asyncio.TimeoutError, cryptoNodeException, exc.RpcException, OSError) as error:
+
+				await self.send_failed(dest, priority, item[2], error)
+
+			else:
+
+				self.backoff.succeeded(dest)
+
+			finally:
+
+				self.sending.discard(dest)
+
+				# Another worker may be waiting for this destination
+
+				self.send_wakeup.set()
+
+			self.coins[0].poll_reset()
+
+	############################################################################
+
+	async def send_failed(self, dest, priority, item, error):
+
+		# A send that timed out may still have gone - the receiver's dedup cache absorbs a repeat
+
+		(ecc_packet, message) = item
+
+		if self.backoff.route_lost(error):
+
+			try:
+
+				await self.coins[0].setup_route(dest)
+
+			except (cryptoNodeException, exc.RpcException, OSError):
+
+				pass
+
+		if (delay := self.backoff.failed(dest)) is not None:
+
+			logging.info('Retrying {} to {} in {:.1f}s : {}'.format(ecc_packet.get_meth(), dest, delay, str(error) or repr(error)))
+
+			self.scheduler.requeue(dest, priority, item)
+
+		else:
+
+			logging.warning('Giving up on {} to {}, dropping {:d} queued : {}'.format(ecc_packet.get_meth(), dest, len(self.scheduler.drop(dest)), str(error) or repr(error)))
 
 	############################################################################
 
-	def process_ecc_packet(self, ecc_packet):
+	async def send_drain(self):
+
+		while self.scheduler or self.sending:
+
+			await asyncio.sleep(0.05)
+
+	############################################################################
+
+	async def process_ecc_packet(self, ecc_packet):
 
 		# Ensure we have a route back to whoever is sending an ecchat message
 
-		self.coins[0].setup_route(ecc_packet.get_from())
+		await self.coins[0].setup_route(ecc_packet.get_from())
 
-		if ecc_packet.get_meth() == eccPacket.METH_chatMsg:
+		if ecc_packet.get_meth() == eccPacket.METH_helo:
 
 			data = ecc_packet.get_data()
 
-			# send the chatAck message
+			self.peers.update(ecc_packet.get_from(), data['caps'])
 
-			ackData = {'uuid' : data['uuid'],
-					   'cmmd' : data['cmmd'],
-					   'able' : True}
+			if not data['resp']:
+
+				self.send_helo(ecc_packet.get_from(), True)
+
+			return
+
+		# Greet peers new to us that understand helo so that they learn what we support
+
+		if ecc_packet.knows_helo() and self.peers.needs_helo(ecc_packet.get_from()):
+
+			self.send_helo(ecc_packet.get_from(), False)
+
+		if self.dedup.seen(ecc_packet):
+
+			# Only repeat the acknowledgement or reply, in case that is what went missing
+
+			if ecc_packet.get_meth() == eccPacket.METH_chatMsg:
 
-			self.send_ecc_packet(ecc_packet.get_from(), eccPacket.METH_chatAck, ackData)
+				self.acknowledge(ecc_packet.get_from(), ecc_packet.get_data())
+
+			elif reply := self.dedup.reply(ecc_packet):
+
+				self.send_ecc_packet(ecc_packet.get_from(), *reply)
+
+			return
+
+		if ecc_packet.get_meth() == eccPacket.METH_chatMsg:
+
+			data = ecc_packet.get_data()
+
+			self.acknowledge(ecc_packet.get_from(), data)
 
 			reply = []
 
 			if data['text'].startswith('#BALANCE'):
 
-				reply.append("Balance = {:f}".format(self.coins[0].get_balance()))
+				reply.append("Balance = {:f}".format(await self.coins[0].get_balance()))
+
+			elif data['text'].startswith('#STATS'):
+
+				reply.extend(self.stats())
 
 			elif data['text'].startswith('#STOP!!!'):
 
 				reply.append("ececho stopping ...")
 
-				self.running = False
+				self.stop()
 
 			elif data['text'].startswith('"') and data['text'].endswith('"'):
 
@@ -122,7 +293,7 @@ class EchoApp:
 
 			if data['coin'] == self.coins[0].symbol:
 
-				address = self.coins[0].get_new_address()
+				address = await self.coins[0].get_new_address()
 
 				rData = {'uuid' : data['uuid'],
 						 'coin' : data['coin'],
@@ -130,6 +301,8 @@ class EchoApp:
 
 				self.send_ecc_packet(ecc_packet.get_from(), eccPacket.METH_addrRes, rData)
 
+				self.dedup.remember(ecc_packet, eccPacket.METH_addrRes, rData)
+
 			else:
 
 				rData = {'uuid' : data['uuid'],
@@ -138,15 +311,113 @@ class EchoApp:
 
 				self.send_ecc_packet(ecc_packet.get_from(), eccPacket.METH_addrRes, rData)
 
+				self.dedup.remember(ecc_packet, eccPacket.METH_addrRes, rData)
+
 		else:
 
 			pass
 
 	############################################################################
 
+	def send_helo(self, dest, resp):
+
+		self.send_ecc_packet(dest, eccPacket.METH_helo, {'caps' : sorted(self.caps), 'resp' : resp})
+
+	############################################################################
+
+	def acknowledge(self, dest, data):
+
+		# Cumulatively where the peer supports it
+
+		if eccPacket.CAP_acks in self.peers.get(dest):
+
+			self.acks.put(dest, data['uuid'])
+
+		else:
+
+			ackData = {'uuid' : data['uuid'],
+					   'cmmd' : data['cmmd'],
+					   'able' : True}
+
+			self.send_ecc_packet(dest, eccPacket.METH_chatAck, ackData)
+
+	############################################################################
+
+	def stats(self):
+
+		return ['peers    : {:d} known, {:d} helos received, {:d} pings answered'.format(len(self.peers.peers), self.peers.helos, self.pings),
+				'inbound  : {:d} received, {:d} dropped, {:d} invalid, {:d} max queued'.format(self.inbound.received, self.inbound.dropped, self.inbound.invalid, self.inbound.depth),
+				'fragment : {:d} received, {:d} messages, {:d} duplicate, {:d} expired, {:d} evicted'.format(self.reassembly.fragments, self.reassembly.messages, self.reassembly.duplicates, self.reassembly.expired, self.reassembly.evicted),
+				'dedup    : {:d} lookups, {:d} duplicates, {:d} remembered'.format(self.dedup.lookups, self.dedup.hits, len(self.dedup.entries)),
+				'outbound : {:d} batched messages in {:d} packets'.format(self.outbound.messages, self.outbound.packets),
+				'shaper   : {:d} throttled at {:g}/s per party, {:d} throttled at {:g}/s overall'.format(self.shaper.throttled, self.shaper.rate, self.shaper.throttled_total, self.shaper.total.rate),
+				'retries  : {:d} failed sends, {:d} recovered, {:d} abandoned'.format(self.backoff.failures, self.backoff.recovered, self.backoff.abandoned),
+				'queues   : ' + ', '.join('{} {:d} sent {:d} max queued'.format(name, self.scheduler.sent[index], self.scheduler.max_depth[index]) for index, name in enumerate(eccScheduler.PRIORITY_NAMES)) + ', {:d} max per party'.format(self.scheduler.max_dest),
+				'acks     : {:d} uuids in {:d} chatAcks, {:d} piggybacked'.format(self.acks.messages, self.acks.packets + self.acks.piggybacked, self.acks.piggybacked)]
+
+	############################################################################
+
+	def dispatch_ecc_packet(self, ecc_packet):
+
+		sender = ecc_packet.get_from()
+
+		# Pings are answered here, without a task or a route lookup, to keep the time measured down to the mesh
+
+		if ecc_packet.get_meth() == eccPacket.METH_ping:
+
+			self.transmit(sender, [(eccPacket.METH_pong, ecc_packet.get_data())])
+
+			self.pings += 1
+
+			return
+
+		if sender not in self.peer_locks:
+
+			self.peer_locks[sender] = asyncio.Lock()
+			self.peer_count[sender] = 0
+
+		self.peer_count[sender] += 1
+
+		task = asyncio.create_task(self.handle_ecc_packet(sender, ecc_packet))
+
+		self.tasks.add(task)
+
+		task.add_done_callback(self.tasks.discard)
+
+	############################################################################
+
+	async def handle_ecc_packet(self, sender, ecc_packet):
+
+		# Packets from one peer are handled in arrival order, different peers concurrently
+
+		try:
+
+			async with self.peer_locks[sender], self.job_slots:
+
+				await asyncio.wait_for(self.process_ecc_packet(ecc_packet), self.timeout)
+
+		except asyncio.TimeoutError:
+
+			logging.warning('Timeout handling {} from {}'.format(ecc_packet.get_meth(), sender))
+
+		except (cryptoNodeException, exc.RpcException, OSError) as error:
+
+			logging.warning('Error handling {} from {} : {}'.format(ecc_packet.get_meth(), sender, str(error)))
+
+		finally:
+
+			self.peer_count[sender] -= 1
+
+			if self.peer_count[sender] == 0:
+
+				del self.peer_locks[sender]
+				del self.peer_count[sender]
+
+	############################################################################
+
 	def zmqInitialise(self):
 
-		self.context = zmq.Context()
+		self.context = zmq.asyncio.Context()
 
 		for index, coin in enumerate(self.coins):
 
@@ -159,29 +430,105 @@ class EchoApp:
 
 	############################################################################
 
-	def zmqHandler(self, index):
+	async def zmqHandler(self, index):
 
-		[address, contents] = self.subscribers[index].recv_multipart()
+		[address, contents] = await self.subscribers[index].recv_multipart()
 		
 		if address.decode() == 'packet':
 
 			protocolID = contents.decode()[1:]
 
-			eccbuffer = self.coins[0].get_buffer(int(protocolID))
+			self.dispatch_buffer(await self.coins[0].get_buffer(int(protocolID)))
+
+	############################################################################
+
+	async def bufferPoller(self):
+
+		# Used when eccoind does not publish packet notifications
+
+		self.dispatch_buffer(await self.coins[0].poll_buffer())
+
+		await asyncio.sleep(self.coins[0].pollInterval)
+
+	############################################################################
+
+	def dispatch_buffer(self, eccbuffer):
 
-			if eccbuffer:
+		if eccbuffer:
 
-				for packet in eccbuffer.values():
+			for ecc_packet in self.reassembly.reassemble(eccPacket.decode_buffer(eccbuffer)):
 
-					message = codecs.decode(packet, 'hex').decode()
+				if ecc_packet:
 
 					if self.debug:
 
-						logging.info('RX: {}'.format(message))
+						logging.info('RX: {}'.format(ecc_packet.to_json()))
+
+					self.inbound.put(ecc_packet)
+
+				else:
+
+					self.inbound.put_invalid()
+
+			if not self.drainer:
+
+				self.drainer = asyncio.create_task(self.drain_buffer())
+
+	############################################################################
+
+	async def drain_buffer(self):
+
+		try:
+
+			while self.inbound:
+
+				# Leave packets queued per sender rather than as tasks while all job slots are busy
+
+				while len(self.tasks) >= self.jobs:
+
+					await asyncio.wait(self.tasks, return_when = asyncio.FIRST_COMPLETED)
+
+				for ecc_packet in self.inbound.get_slice():
+
+					self.dispatch_ecc_packet(ecc_packet)
+
+				await asyncio.sleep(0)
+
+		finally:
+
+			self.drainer = None
+
+	############################################################################
+
+	async def zmqReceiver(self):
 
-					ecc_packet = eccPacket.from_json(message)
+		if self.coins[0].zmqPackets:
 
-					self.process_ecc_packet(ecc_packet)
+			receive = partial(self.zmqHandler, 0)
+
+		else:
+
+			receive = self.bufferPoller
+
+		try:
+
+			while self.running:
+
+				try:
+
+					await receive()
+
+				except (cryptoNodeException, exc.RpcException, asyncio.TimeoutError, OSError) as error:
+
+					logging.warning('Error fetching buffer : {}'.format(str(error)))
+
+					# Wait before trying again, rather than spinning while eccoind is down
+
+					await asyncio.sleep(self.coins[0].pollInterval)
+
+		finally:
+
+			self.stop()
 
 	############################################################################
 
@@ -195,21 +542,31 @@ class EchoApp:
 
 	############################################################################
 
-	def reset_buffer_timeout(self):
+	async def reset_buffer_timeout(self):
+
+		while True:
 
-		self.coins[0].reset_buffer_timeout()
+			await asyncio.sleep(10)
+
+			try:
+
+				await self.coins[0].reset_buffer_timeout()
+
+			except (exc.RpcException, OSError, asyncio.TimeoutError) as error:
+
+				logging.warning('Error resetting buffer timeout : {}'.format(str(error)))
 
 	############################################################################
 
-	def cryptoInitialise(self):
+	async def cryptoInitialise(self):
 
-		if loadConfigurationECC(self.coins, self.protocol_id):
+		if loadConfigurationECC(self.coins, self.protocol_id, partial(asyncEccoinNode, timeout = self.timeout)):
 
 			for coin in self.coins:
 
 				try:
 
-					coin.initialise()
+					await coin.initialise()
 
 				except cryptoNodeException as error:
 
@@ -217,41 +574,106 @@ class EchoApp:
 
 					return False
 
-				self.timer = RepeatTimer(10, self.reset_buffer_timeout)
-
-				self.timer.start()
-
 			return True
 
 		return False
 
 	############################################################################
 
-	def cryptoShutdown(self):
+	async def cryptoShutdown(self):
 
-		if self.timer:
+		for coin in self.coins:
 
-			self.timer.cancel()
+			await coin.shutdown()
 
-		for coin in self.coins:
+	############################################################################
+
+	def stop(self):
 
-			coin.shutdown()
+		self.running = False
+
+		self.stopping.set()
 
 	############################################################################
 
-	def run(self):
+	def terminate(self, signalNumber):
+
+		logging.info('%s received - terminating' % signal.Signals(signalNumber).name)
+
+		self.stop()
+
+	############################################################################
+
+	async def main(self):
+
+		self.stopping  = asyncio.Event()
+		self.job_slots = asyncio.Semaphore(self.jobs)
+		self.outbound  = eccCoalescer(self.transmit, asyncio.get_running_loop().call_later)
+		self.acks      = eccAckCollector(self.send_acks, asyncio.get_running_loop().call_later)
+
+		self.send_wakeup = asyncio.Event()
 
-		if self.cryptoInitialise():
+		for signalNumber in (signal.SIGINT, signal.SIGTERM):
+
+			asyncio.get_running_loop().add_signal_handler(signalNumber, self.terminate, signalNumber)
+
+		if await self.cryptoInitialise():
 
 			self.zmqInitialise()
 
-			while self.running:
+			keepalive = asyncio.create_task(self.reset_buffer_timeout())
+			receiver  = asyncio.create_task(self.zmqReceiver())
+			senders   = [asyncio.create_task(self.send_worker()) for _ in range(self.senders)]
+
+			await self.stopping.wait()
+
+			receiver.cancel()
+
+			# Let requests in flight finish - including the reply to #STOP!!!
+
+			if self.tasks:
+
+				await asyncio.wait(self.tasks, timeout = self.timeout)
+
+			self.acks.flush_all()
+
+			self.outbound.flush_all()
+
+			if self.tasks:
+
+				await asyncio.wait(self.tasks, timeout = self.timeout)
 
-				self.zmqHandler(0)
+			try:
+
+				await asyncio.wait_for(self.send_drain(), self.timeout)
+
+			except asyncio.TimeoutError:
+
+				logging.warning('{:d} packets unsent at shutdown'.format(len(self.scheduler)))
+
+			keepalive.cancel()
+
+			for sender in senders:
+
+				sender.cancel()
+
+			await asyncio.gather(*senders, return_exceptions = True)
+
+			for result in await asyncio.gather(receiver, keepalive, return_exceptions = True):
+
+				if isinstance(result, Exception):
+
+					logging.error('Receiver failed : {}'.format(repr(result)))
 
 			self.zmqShutdown()
 
-		self.cryptoShutdown()
+		await self.cryptoShutdown()
+
+	############################################################################
+
+	def run(self):
+
+		asyncio.run(self.main())
 
 ################################################################################
 
@@ -286,10 +708,16 @@ def main():
 
 	argparser = argparse.ArgumentParser(description='Echo service for ecchat')
 
-	argparser.add_argument('-p', '--protocol', action='store'     , help='Protocol ID'      , type=int, default=1       , required=False)
-	argparser.add_argument('-n', '--name'    , action='store'     , help='nickname'         , type=str, default='ececho', required=False)
-	argparser.add_argument('-x', '--prefix'  , action='store'     , help='reply prefix'     , type=str, default='> '    , required=False)
-	argparser.add_argument('-d', '--debug'   , action='store_true', help='debug message log',                             required=False)
+	argparser.add_argument('-p', '--protocol'   , action='store'     , help='Protocol ID'            , type=int  , default=1       , required=False)
+	argparser.add_argument('-n', '--name'       , action='store'     , help='nickname'               , type=str  , default='ececho', required=False)
+	argparser.add_argument('-x', '--prefix'     , action='store'     , help='reply prefix'           , type=str  , default='> '    , required=False)
+	argparser.add_argument('-t', '--timeout'    , action='store'     , help='RPC timeout (s)'        , type=int  , default=10      , required=False)
+	argparser.add_argument('-j', '--jobs'       , action='store'     , help='max requests'           , type=int  , default=64      , required=False)
+	argparser.add_argument('-d', '--debug'      , action='store_true', help='debug message log'      ,                               required=False)
+	argparser.add_argument('-r', '--rate'       , action='store'     , help='max packets/s per party', type=float, default=20.0    , required=False)
+	argparser.add_argument('-b', '--burst'      , action='store'     , help='max burst per party'    , type=int  , default=40      , required=False)
+	argparser.add_argument('-R', '--total-rate' , action='store'     , help='max packets/s to all'   , type=float, default=50.0    , required=False)
+	argparser.add_argument('-B', '--total-burst', action='store'     , help='max burst to all'       , type=int  , default=100     , required=False)
 
 	command_line_args = argparser.parse_args()
 
@@ -298,7 +726,13 @@ def main():
 	app = EchoApp(command_line_args.protocol,
 	              command_line_args.name,
 	              command_line_args.prefix,
-	              command_line_args.debug)
+	              command_line_args.timeout,
+	              command_line_args.jobs,
+	              command_line_args.debug,
+	              command_line_args.rate,
+	              command_line_args.burst,
+	              command_line_args.total_rate,
+	              command_line_args.total_burst)
 
 	app.run()
 
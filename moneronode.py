@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# coding: UTF-8
+
+import requests
+
+from datetime import datetime
+
+# RPC interface for Monero type nodes
+
+from monero.wallet import Wallet
+from monero.daemon import Daemon
+from monero.transaction import PaymentFilter
+
+import monero.exceptions
+
+from cryptonode import cryptoNode, cryptoNodeException
+
+################################################################################
+## moneroNode class ############################################################
+################################################################################
+
+class moneroNode(cryptoNode):
+
+	config_keys = cryptoNode.config_keys | {'daemonconnect', 'daemonport'}
+
+	history_margin = 10				# blocks rescanned behind the history checkpoint
+
+	############################################################################
+
+	def __init__(self, symbol, rpc_address, rpc_daemon, rpc_user, rpc_pass):
+
+		super().__init__(symbol, rpc_address, rpc_user, rpc_pass)
+
+		(host, port) = tuple(rpc_address.split(':'))
+
+		try:
+
+			self.wallet = Wallet(host=host, port=port, user=rpc_user, password=rpc_pass)
+
+		except monero.backends.jsonrpc.exceptions.Unauthorized:
+
+			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} wallet'.format(self.symbol))
+
+		except requests.exceptions.ConnectTimeout:
+
+			raise cryptoNodeException('Failed to connect - check that {} wallet is running'.format(self.symbol))
+
+		(host, port) = tuple(rpc_daemon.split(':'))
+
+		try:
+
+			self.daemon = Daemon(host=host, port=port)
+
+		except monero.backends.jsonrpc.exceptions.Unauthorized:
+
+			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} daemon'.format(self.symbol))
+
+		except requests.exceptions.ConnectTimeout:
+
+			raise cryptoNodeException('Failed to connect - check that {} daemon is running'.format(self.symbol))
+
+	############################################################################
+
+	@classmethod
+
+	def from_config(cls, symbol, section):
+
+		rpc_address = '{}:{}'.format(section['rpcconnect'],    section['rpcport'])
+		rpc_daemon  = '{}:{}'.format(section['daemonconnect'], section['daemonport'])
+
+		return cls(symbol, rpc_address, rpc_daemon, section['rpcuser'], section['rpcpassword'])
+
+	############################################################################
+
+	def __getattr__(self, method):
+
+		return getattr(self.proxy, method)
+
+		pass
+
+	############################################################################
+
+	def initialise(self):
+
+		pass
+
+	############################################################################
+
+	def refresh(self):
+
+		try:
+
+			self.blocks = self.wallet.height()
+
+		except monero.backends.jsonrpc.exceptions.Unauthorized:
+
+			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} wallet'.format(self.symbol))
+
+		except requests.exceptions.ConnectTimeout:
+
+			raise cryptoNodeException('Failed to connect - check that {} wallet is running'.format(self.symbol))
+
+		try:
+
+			info = self.daemon.info()
+
+		except monero.backends.jsonrpc.exceptions.Unauthorized:
+
+			raise cryptoNodeException('Failed to connect - error in rpcuser or rpcpassword for {} daemon'.format(self.symbol))
+
+		except requests.exceptions.ConnectTimeout:
+
+			raise cryptoNodeException('Failed to connect - check that {} daemon is running'.format(self.symbol))
+
+		self.peers = info['incoming_connections_count'] + info['outgoing_connections_count']
+
+	############################################################################
+
+	def get_balance(self):
+
+		return self.wallet.balance()
+
+	############################################################################
+
+	def get_unlocked_balance(self):
+
+		return self.wallet.balance(unlocked=True)
+
+	############################################################################
+
+	def get_unconfirmed_balance(self):
+
+		amount = 0.0
+
+		transfers = self.wallet._backend.transfers_in(0, PaymentFilter(unconfirmed=True, confirmed=False))
+
+		for transfer in transfers:
+
+			amount += float(transfer.amount)
+
+		return amount
+
+	############################################################################
+
+	def get_new_address(self):
+
+		return str(self.wallet.address())
+
+	############################################################################
+
+	def wallet_locked(self):
+
+		# Assume that wallet is unlocked when monero-wallet-rpc is started
+
+		return False
+
+	############################################################################
+
+	def unlock_wallet(self, passphrase, seconds):
+
+		return True
+
+	############################################################################
+
+	def send_to_address(self, address, amount, comment):
+
+		return self.wallet.transfer(address, float(amount))[0].hash
+
+	############################################################################
+
+	def sync_history(self):
+
+		history = self.load_history()
+
+		# Rescan a few blocks behind the checkpoint to pick up any reorganisation
+
+		min_height = max(0, (history.checkpoint or 0) - self.history_margin)
+
+		try:
+
+			height   = self.wallet.height()
+			incoming = self.wallet.incoming(min_height = min_height, unconfirmed = True)
+			outgoing = self.wallet.outgoing(min_height = min_height, unconfirmed = True)
+
+		except (monero.backends.jsonrpc.exceptions.Unauthorized, requests.exceptions.ConnectionError) as error:
+
+			raise cryptoNodeException('{} wallet returned error: {}'.format(self.symbol, str(error)))
+
+		for payment in incoming:
+
+			self.add_payment(history, payment, 'RX', str(payment.local_address))
+
+		for payment in outgoing:
+
+			addr = str(payment.destinations[0][0]) if payment.destinations else ''
+
+			self.add_payment(history, payment, 'TX', addr)
+
+		history.advance(height)
+
+		history.commit()
+
+		return history
+
+	############################################################################
+
+	def add_payment(self, history, payment, direction, addr):
+
+		history.add(payment.transaction.hash, direction, addr, payment.timestamp or datetime.now(), float(payment.amount), addr)
+
+	############################################################################
+
+	def start_fee_estimates(self):
+
+		pass
+
+	############################################################################
+
+	def get_fee_estimate(self):
+
+		# No estimate is available without a blocking wallet call
+
+		return None
+
+	############################################################################
+
+	def shutdown(self):
+
+		pass
+
+################################################################################
@@ -2,8 +2,9 @@
 # coding: UTF-8
 
 from datetime   import datetime
+from functools  import partial
 from eccpacket  import eccPacket
-from cryptonode import cryptoNode, eccoinNode, bitcoinNode, moneroNode, cryptoNodeException
+from cryptonode import cryptoNode, cryptoNodeException, balance_error
 
 ################################################################################
 ## txSend class ################################################################
@@ -91,9 +92,9 @@ class txSend():
 
 			return
 
-		if self.f_amount >= balance:
+		if error := balance_error(self.f_amount, balance, self.coin.get_fee_estimate(), 'Invalid send amount'):
 
-			self.do_failure('Invalid send amount - must be less than current balance = {:f}'.format(balance))
+			self.do_failure(error)
 
 			return
 
@@ -157,7 +158,9 @@ class txSend():
 
 		self.parent.send_ecc_packet(eccPacket.METH_addrReq, data)
 
-		self.parent.loop.set_alarm_in(10, self.do_addr_req_timeout)
+		# Repeated on the other party's retransmission timeout, failing once the retries run out
+
+		self.parent.arq.track(self.parent.otherTag, (eccPacket.METH_addrReq, self.uuid), partial(self.parent.send_ecc_packet, eccPacket.METH_addrReq, data), self.do_addr_req_timeout)
 
 	############################################################################
 
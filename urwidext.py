@@ -287,6 +287,18 @@ class MessageWalker(urwid.SimpleListWalker):
 
 	############################################################################
 
+	def get_markup_text(self, uuid, element):
+
+		for index, _uuid in enumerate(self.uuid):
+
+			if uuid == _uuid:
+
+				return self.text[index][element][1]
+
+		return ''
+
+	############################################################################
+
 	def set_markup_style(self, uuid, element, style):
 
 		for index, _uuid in enumerate(self.uuid):
@@ -307,6 +319,34 @@ class MessageWalker(urwid.SimpleListWalker):
 
 	############################################################################
 
+	def set_markup_styles(self, uuids, element, style):
+
+		# One pass over the walker for any number of uuids
+
+		uuids = set(uuids)
+
+		for index, _uuid in enumerate(self.uuid):
+
+			if _uuid in uuids:
+
+				markup = self.text[index]
+
+				(old_style, text) = markup[element]
+
+				markup[element] = (style, text)
+
+				self[index].set_text(markup)
+
+				self.text[index] = markup
+
+				uuids.discard(_uuid)
+
+				if not uuids:
+
+					break
+
+	############################################################################
+
 	def recall(self, qual, element, direction):
 
 		text = ''
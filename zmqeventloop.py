@@ -3,6 +3,7 @@
 
 import urwid
 import heapq
+import math
 import time
 import zmq
 import os
@@ -15,48 +16,417 @@ zmq_magic = 99999
 
 ################################################################################
 
-class zmqEventLoop(EventLoop):
+class alarmHeap():
+
+	# Alarms in a binary heap of [due, tie break, callback, in heap] - the
+	# callback is cleared once the alarm is cancelled or has run. Cancelled
+	# alarms are left in place and skipped when they reach the top
 
-	_alarm_break = count()
+	_compact_min = 64							# Cancelled alarms tolerated before compaction is considered
 
 	#############################################################################
 
-	def __init__(self):
+	def __init__(self, clock = time.monotonic):
 
-		self._did_something   = True
-		self._alarms          = []
-		self._poller          = zmq.Poller()
-		self._queue_callbacks = {}				# Callback functions
-		self._queue_callbacki = {}				# Index to pass to callback function
-		self._idle_handle     = 0
-		self._idle_callbacks  = {}
+		self.clock     = clock
+		self.alarms    = []
+		self.sequence  = count()
+		self.count     = 0
+		self.cancelled = 0						# Cancelled alarms still in the heap
 
 	#############################################################################
 
-	def alarm(self, seconds, callback):
+	def __len__(self):
+
+		return self.count
+
+	#############################################################################
+
+	def add(self, seconds, callback):
+
+		handle = [self.clock() + seconds, next(self.sequence), callback, True]
+
+		heapq.heappush(self.alarms, handle)
 
-		handle = (time.time() + seconds, next(self._alarm_break), callback)
+		self.count += 1
 
-		heapq.heappush(self._alarms, handle)
-		
 		return handle
 
 	#############################################################################
 
-	def remove_alarm(self, handle):
+	def cancel(self, handle):
 
-		try:
+		# Callers pass 0 for an alarm never set, which urwid treats as not found
+
+		if not isinstance(handle, list) or handle[2] is None:
+
+			return False
+
+		handle[2] = None
+
+		self.count -= 1
 
-			self._alarms.remove(handle)
+		# An alarm already popped as due is only waiting for take
 
-			heapq.heapify(self._alarms)
+		if not handle[3]:
 
 			return True
 
-		except ValueError:
+		self.cancelled += 1
+
+		# Rebuild once most of the heap is dead, so the cost stays O(1) per cancel when amortised
+
+		if self.cancelled > self._compact_min and self.cancelled * 2 > len(self.alarms):
+
+			self.alarms = [handle for handle in self.alarms if handle[2] is not None]
+
+			heapq.heapify(self.alarms)
+
+			self.cancelled = 0
+
+		return True
+
+	#############################################################################
+
+	def next_due(self):
+
+		# Seconds until the next alarm, None if there is none
+
+		while self.alarms and self.alarms[0][2] is None:
+
+			heapq.heappop(self.alarms)
+
+			self.cancelled -= 1
+
+		return max(0, self.alarms[0][0] - self.clock()) if self.alarms else None
+
+	#############################################################################
+
+	def pop_due(self):
+
+		# The alarms now due, in order - each is run through take, as an earlier one may cancel it
+
+		now = self.clock()
+
+		handles = []
+
+		while self.alarms and self.alarms[0][0] <= now:
+
+			handle = heapq.heappop(self.alarms)
+
+			if handle[2] is None:
+
+				self.cancelled -= 1
+
+				continue
+
+			handle[3] = False
+
+			handles.append(handle)
+
+		return handles
+
+	#############################################################################
+
+	def take(self, handle):
+
+		# The callback of a due alarm, or None if it has been cancelled since
+
+		(callback, handle[2]) = (handle[2], None)
+
+		if callback is not None:
+
+			self.count -= 1
+
+		return callback
+
+################################################################################
+
+class wheelTimer():
+
+	__slots__ = ('due', 'tick', 'seq', 'callback', 'level', 'index')
+
+	def __init__(self, due, tick, seq, callback):
+
+		self.due      = due
+		self.tick     = tick
+		self.seq      = seq
+		self.callback = callback					# None once cancelled or run
+		self.level    = 0
+		self.index    = 0
+
+################################################################################
+
+class timerWheel():
+
+	# Hierarchical timing wheel, after Varghese and Lauck. Each level has 64
+	# slots, one tick wide at level 0 and 64 times wider at each level up. A
+	# timer goes in the lowest level whose current span holds its tick, and
+	# moves down as the wheel turns onto its slot. Timers due in the same tick
+	# share a slot and run together, in order of due time. Adding and
+	# cancelling are O(1), and empty ticks are skipped using a bitmap of the
+	# occupied slots at each level
+
+	BITS   = 6
+	SLOTS  = 1 << BITS
+	MASK   = SLOTS - 1
+	LEVELS = 4									# 64 ** 4 ticks - about 46 hours at 10ms
+
+	READY    = -1								# level of timers already due
+	TAKEN    = -2								# level of timers popped as due, waiting for take
+	OVERFLOW = LEVELS							# level of timers beyond the top level
+
+	#############################################################################
+
+	def __init__(self, tick = 0.01, clock = time.monotonic):
+
+		self.tick     = tick
+		self.clock    = clock
+		self.origin   = clock()
+		self.now      = 0						# Last tick turned to
+		self.slots    = [[{} for _ in range(self.SLOTS)] for _ in range(self.LEVELS)]
+		self.bitmap   = [0] * self.LEVELS			# Bit n set while slot n of the level holds timers
+		self.ready    = {}
+		self.overflow = {}
+		self.sequence = count()
+		self.count    = 0
+
+	#############################################################################
+
+	def __len__(self):
+
+		return self.count
+
+	#############################################################################
+
+	def add(self, seconds, callback):
+
+		due = self.clock() + seconds
+
+		# Rounded up, so that a timer never runs early
+
+		timer = wheelTimer(due, math.ceil((due - self.origin) / self.tick), next(self.sequence), callback)
+
+		self.place(timer)
+
+		self.count += 1
+
+		return timer
+
+	#############################################################################
+
+	def place(self, timer):
+
+		if timer.tick <= self.now:
+
+			timer.level = self.READY
+
+			self.ready[timer] = None
+
+			return
+
+		# The highest bit in which the tick differs from now picks the level
+
+		level = ((timer.tick ^ self.now).bit_length() - 1) // self.BITS
+
+		if level >= self.LEVELS:
+
+			timer.level = self.OVERFLOW
+
+			self.overflow[timer] = None
+
+			return
+
+		index = (timer.tick >> (self.BITS * level)) & self.MASK
+
+		timer.level = level
+		timer.index = index
+
+		self.slots[level][index][timer] = None
+
+		self.bitmap[level] |= 1 << index
+
+	#############################################################################
+
+	def cancel(self, timer):
+
+		if not isinstance(timer, wheelTimer) or timer.callback is None:
 
 			return False
 
+		timer.callback = None
+
+		self.count -= 1
+
+		if timer.level == self.TAKEN:
+
+			pass
+
+		elif timer.level == self.READY:
+
+			del self.ready[timer]
+
+		elif timer.level == self.OVERFLOW:
+
+			del self.overflow[timer]
+
+		else:
+
+			slot = self.slots[timer.level][timer.index]
+
+			del slot[timer]
+
+			if not slot:
+
+				self.bitmap[timer.level] &= ~(1 << timer.index)
+
+		return True
+
+	#############################################################################
+
+	def next_tick(self):
+
+		# The next tick at which a timer runs or moves down a level, None if there is none
+
+		return self.now if self.ready else self.next_turn()
+
+	#############################################################################
+
+	def next_turn(self):
+
+		for level in range(self.LEVELS):
+
+			shift = self.BITS * level
+
+			above = self.bitmap[level] >> (((self.now >> shift) & self.MASK) + 1)
+
+			if above:
+
+				index = ((self.now >> shift) & self.MASK) + (above & -above).bit_length()
+
+				return (self.now >> (shift + self.BITS) << (shift + self.BITS)) | (index << shift)
+
+		if self.overflow:
+
+			return ((self.now >> (self.BITS * self.LEVELS)) + 1) << (self.BITS * self.LEVELS)
+
+		return None
+
+	#############################################################################
+
+	def next_due(self):
+
+		if (tick := self.next_tick()) is None:
+
+			return None
+
+		return max(0, self.origin + tick * self.tick - self.clock())
+
+	#############################################################################
+
+	def turn(self):
+
+		# Move down the timers in the slots the wheel has just reached, coarsest first
+
+		if not self.now & ((1 << (self.BITS * self.LEVELS)) - 1):
+
+			(timers, self.overflow) = (self.overflow, {})
+
+			for timer in timers:
+
+				self.place(timer)
+
+		for level in range(self.LEVELS - 1, -1, -1):
+
+			shift = self.BITS * level
+
+			if self.now & ((1 << shift) - 1):
+
+				continue
+
+			index = (self.now >> shift) & self.MASK
+
+			if self.bitmap[level] & (1 << index):
+
+				(timers, self.slots[level][index]) = (self.slots[level][index], {})
+
+				self.bitmap[level] &= ~(1 << index)
+
+				for timer in timers:
+
+					self.place(timer)
+
+	#############################################################################
+
+	def pop_due(self):
+
+		target = math.floor((self.clock() - self.origin) / self.tick)
+
+		while (tick := self.next_turn()) is not None and tick <= target:
+
+			self.now = tick
+
+			self.turn()
+
+		# No timer runs or moves in between, so the wheel can jump straight there
+
+		self.now = max(self.now, target)
+
+		# Each is run through take, as an earlier one may cancel it
+
+		timers = sorted(self.ready, key = lambda timer: (timer.due, timer.seq))
+
+		self.ready = {}
+
+		for timer in timers:
+
+			timer.level = self.TAKEN
+
+		return timers
+
+	#############################################################################
+
+	def take(self, timer):
+
+		# The callback of a due timer, or None if it has been cancelled since
+
+		(callback, timer.callback) = (timer.callback, None)
+
+		if callback is not None:
+
+			self.count -= 1
+
+		return callback
+
+################################################################################
+
+class zmqEventLoop(EventLoop):
+
+	#############################################################################
+
+	def __init__(self, alarms = None):
+
+		self._did_something   = True
+		self._alarms          = alarms if alarms is not None else timerWheel()	# alarmHeap or timerWheel, both on the monotonic clock
+		self._poller          = zmq.Poller()
+		self._queue_callbacks = {}				# Callback functions
+		self._queue_callbacki = {}				# Index to pass to callback function
+		self._idle_handle     = 0
+		self._idle_callbacks  = {}
+		self._deferred        = []				# Run once after the next idle, eg. screen redraw
+
+	#############################################################################
+
+	def alarm(self, seconds, callback):
+
+		return self._alarms.add(seconds, callback)
+
+	#############################################################################
+
+	def remove_alarm(self, handle):
+
+		return self._alarms.cancel(handle)
+
 	#############################################################################
 
 	def watch_queue(self, queue, callback, flags=1, index=zmq_magic):
@@ -163,6 +533,22 @@ class zmqEventLoop(EventLoop):
 
 	#############################################################################
 
+	def defer(self, callback):
+
+		self._deferred.append(callback)
+
+	#############################################################################
+
+	def _run_deferred(self):
+
+		deferred, self._deferred = self._deferred, []
+
+		for callback in deferred:
+
+			callback()
+
+	#############################################################################
+
 	def run(self):
 
 		try:
@@ -193,7 +579,7 @@ class zmqEventLoop(EventLoop):
 
 				state = 'alarm'
 
-				timeout = max(0, self._alarms[0][0] - time.time())
+				timeout = self._alarms.next_due()
 
 			if self._did_something and (not self._alarms or (self._alarms and timeout > 0)):
 
@@ -217,13 +603,23 @@ class zmqEventLoop(EventLoop):
 
 				self._did_something = False
 
+				if self._deferred:
+
+					self._run_deferred()
+
+					self._did_something = True
+
 			elif state == 'alarm':
 
-				due, tie_break, callback = heapq.heappop(self._alarms)
+				# Alarms due in the same tick are run together, skipping any that one of them cancels
+
+				for handle in self._alarms.pop_due():
+
+					if (callback := self._alarms.take(handle)) is not None:
 
-				callback()
+						callback()
 
-				self._did_something = True
+						self._did_something = True
 
 		for queue, _ in ready.items():
 